@@ -0,0 +1,433 @@
+from pycolonies import Crypto
+from pycolonies import colonies_client
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import asyncio
+import hashlib
+import inspect
+import json
+import marshal
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+
+# Base class for executors. A subclass marks the methods implementing its functions with @function, and
+# the base class registers the executor and the functions, runs the assign loops, and closes or fails the
+# processes:
+#
+#   class PythonExecutor(Executor):
+#       @function("helloworld")
+#       def helloworld(self, process):
+#           return ["helloworld"]
+#
+# The return value of a function is the output of the process, a function that raises an exception fails
+# the process. Functions are executed in one of these ways:
+#
+#   thread    every worker thread keeps one assign in flight and executes the processes it is assigned
+#   process   as thread, but CPU heavy work passed to self.offload() runs in a pool of worker processes
+#   asyncio   one thread assigns the processes, and schedules the functions defined with async def on an
+#             event loop without waiting for them, so up to workers processes wait for I/O at the same time.
+#             Other functions are executed by the assigning thread, and block it until they return
+#
+# With prefetch > 0, the executor does not wait for a process to be closed before asking for the next one.
+# prefetch assigner threads keep assign requests open and put the assigned processes in a local queue, the
+# workers take the processes from the queue, and the processes are closed in the background. At most
+# workers + prefetch processes are assigned to the executor at the same time, so a process never waits long
+# in the local queue while other executors are idle.
+#
+# With memo_dir set, the outputs of functions marked with @function(memo=True) are cached in that directory,
+# keyed by a hash of the function name, args, kwargs, env, input and the source code of the function. A
+# process with the same key is closed with the cached output without calling the function again. Only mark
+# functions that depend on nothing else, e.g. not functions that add children or read files.
+#
+# Ctrl-c stops the executor gracefully: the workers finish the processes they are working on, the statistics
+# are printed and the executor is unregistered. Ctrl-c a second time exits immediately.
+
+POOLS = ("thread", "process", "asyncio")
+
+def function(name=None, memo=False):
+    # marks a method as the implementation of the Colonies function name, by default the name of the method
+    def decorator(method):
+        method.funcname = name if name is not None else method.__name__
+        method.memo = memo
+        return method
+    return decorator
+
+def init_offload_worker():
+    # ctrl-c is handled by the executor, which drains the pool before exiting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def code_hash(method):
+    # the source code of the function, or its bytecode if the source is not available
+    try:
+        code = inspect.getsource(method).encode()
+    except (OSError, TypeError):
+        code = marshal.dumps(method.__code__)
+    return hashlib.sha256(code).hexdigest()
+
+class MemoCache:
+    # outputs stored as one JSON file per key, so executors on the same machine can share the directory
+    def __init__(self, dir):
+        self.dir = dir
+        os.makedirs(dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.dir, key + ".json")
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)["output"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def put(self, key, output):
+        # written to a temporary file first, so a reader never sees half a file
+        tmp = self.path(key) + "." + uuid.uuid4().hex[:6]
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"output": output}, f)
+            os.replace(tmp, self.path(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+class Executor:
+    def __init__(self, executortype, executorname=None, workers=1, pool="thread", assign_timeout=10, prefetch=0,
+                 memo_dir=None):
+        if pool not in POOLS:
+            raise ValueError(f"Invalid pool mode: {pool}, must be one of {', '.join(POOLS)}")
+
+        colonies, colonyname, colony_prvkey, _, _ = colonies_client()
+        self.colonies = colonies
+        self.colonyname = colonyname
+        self.colony_prvkey = colony_prvkey
+        self.executorname = executorname if executorname is not None else executortype + "-" + uuid.uuid4().hex[:6]
+        self.executortype = executortype
+
+        # number of processes handled concurrently, every worker thread keeps one assign in flight. In asyncio
+        # mode, the number of processes on the event loop
+        self.workers = workers
+        self.pool_mode = pool
+        self.assign_timeout = assign_timeout
+        self.prefetch = prefetch
+        self.prefetched = queue.Queue()
+        self.slots = threading.Semaphore(workers + prefetch)
+        self.assigners = []
+        self.closer = None
+        self.offload_pool = None
+        self.loop = None
+        self.stop_event = threading.Event()
+        self.local = threading.local()
+        self.stats = [{"processes": 0, "errors": 0, "busy": 0.0} for _ in range(1 if pool == "asyncio" else workers)]
+        self.stats_lock = threading.Lock()  # in asyncio mode, the event loop adds to the statistics too
+        self.timings = {}  # function name -> {"calls", "total", "max"}
+        self.timings_lock = threading.Lock()
+        self.memo = MemoCache(memo_dir) if memo_dir else None
+
+        self.functions = {}
+        self.code = {}  # function name -> hash of the source code, part of the memo key
+        for _, method in inspect.getmembers(self, predicate=inspect.ismethod):
+            if hasattr(method, "funcname"):
+                self.functions[method.funcname] = method
+                if method.memo:
+                    self.code[method.funcname] = code_hash(method)
+
+        crypto = Crypto()
+        self.executor_prvkey = crypto.prvkey()
+        self.executorid = crypto.id(self.executor_prvkey)
+
+        self.register()
+
+    def register(self):
+        executor = {
+            "executorname": self.executorname,
+            "executorid": self.executorid,
+            "colonyname": self.colonyname,
+            "executortype": self.executortype
+        }
+
+        try:
+            executor = self.colonies.add_executor(executor, self.colony_prvkey)
+            self.colonies.approve_executor(self.colonyname, self.executorname, self.colony_prvkey)
+
+            for funcname in self.functions:
+                self.colonies.add_function(self.colonyname,
+                                           self.executorname,
+                                           funcname,
+                                           self.executor_prvkey)
+        except Exception as err:
+            print(err)
+            os._exit(0)
+
+        print("Executor", self.executorname, "registered")
+
+    def offload(self, func, *args):
+        # runs func in the process pool in process mode, otherwise in the calling worker thread
+        if self.offload_pool is not None:
+            return self.offload_pool.submit(func, *args).result()
+        return func(*args)
+
+    def count(self, name, n=1):
+        # adds n to a statistic of the calling worker, printed with the other statistics
+        with self.stats_lock:
+            stats = self.local.stats
+            stats[name] = stats.get(name, 0) + n
+
+    def memo_key(self, process):
+        spec = process.spec
+        key = {"funcname": spec.funcname, "args": spec.args, "kwargs": spec.kwargs, "env": spec.env,
+               "input": process.input, "code": self.code[spec.funcname]}
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def lookup(self, process):
+        # returns the handler of the process, its memo key (None if it is not cached) and the cached output
+        handler = self.functions.get(process.spec.funcname)
+        if handler is None:
+            raise Exception(f"Unknown function {process.spec.funcname}")
+
+        key, output = None, None
+        if self.memo is not None and handler.memo:
+            key = self.memo_key(process)
+            output = self.memo.get(key)
+            if output is not None:
+                self.count("memo hits")
+        return handler, key, output
+
+    def remember(self, process, key, output):
+        if key is not None:
+            # the function succeeded, so a result that cannot be cached does not fail the process
+            try:
+                self.memo.put(key, output if output is not None else [])
+            except Exception as err:
+                print("Failed to cache the output of", process.processid, err)
+
+    def execute(self, process):
+        # returns the output of the process
+        handler, key, output = self.lookup(process)
+        if output is not None:
+            return output
+
+        if inspect.iscoroutinefunction(handler):
+            output = asyncio.run_coroutine_threadsafe(handler(process), self.loop).result()
+        else:
+            output = handler(process)
+        self.remember(process, key, output)
+        return output
+
+    def on_assigned(self, process):
+        # timing hooks, called by the worker threads, subclasses may extend them
+        print("Process", process.processid, "is assigned to worker", self.local.workerid)
+
+    def on_finished(self, process, elapsed, err):
+        with self.timings_lock:
+            timing = self.timings.setdefault(process.spec.funcname, {"calls": 0, "total": 0.0, "max": 0.0})
+            timing["calls"] += 1
+            timing["total"] += elapsed
+            timing["max"] = max(timing["max"], elapsed)
+
+    def assigner(self):
+        # keeps one assign request open, as long as less than workers + prefetch processes are assigned
+        while not self.stop_event.is_set():
+            if not self.slots.acquire(timeout=0.5):
+                continue
+            process = self.assign()
+            if process is None:
+                self.slots.release()
+            else:
+                self.prefetched.put(process)
+
+    def assign(self):
+        try:
+            return self.colonies.assign(self.colonyname, self.assign_timeout, self.executor_prvkey)
+        except Exception as err:
+            # assign times out when there is nothing to do, just try again
+            if not self.stop_event.is_set():
+                print(err)
+            return None
+
+    def next_process(self):
+        # returns the next process, or None if there is none yet
+        if self.prefetch == 0:
+            return None if self.stop_event.is_set() else self.assign()
+        try:
+            return self.prefetched.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def stopped(self):
+        if self.prefetch == 0:
+            return self.stop_event.is_set()
+        return self.stop_event.is_set() and not any(thread.is_alive() for thread in self.assigners) and self.prefetched.empty()
+
+    def complete(self, process, output, err):
+        if err is None:
+            send = lambda: self.colonies.close(process.processid, output if output is not None else [], self.executor_prvkey)
+        else:
+            send = lambda: self.colonies.fail(process.processid, [str(err)], self.executor_prvkey)
+
+        def complete():
+            try:
+                send()
+            except Exception as e:
+                print(e)
+            finally:
+                if self.prefetch > 0 or self.pool_mode == "asyncio":
+                    self.slots.release()
+
+        if self.closer is not None:
+            self.closer.submit(complete)
+        else:
+            complete()
+
+    def worker(self, workerid):
+        self.local.workerid = workerid
+        self.local.stats = self.stats[workerid]
+        while not self.stopped():
+            process = self.next_process()
+            if process is None:
+                continue
+
+            # a process assigned after ctrl-c is still handled, it would otherwise hang until maxexectime
+            self.on_assigned(process)
+            started = time.time()
+            output, err = None, None
+            try:
+                output = self.execute(process)
+            except Exception as e:
+                err = e
+                print(err)
+            self.finish(process, started, output, err)
+
+    def dispatcher(self):
+        # asyncio mode: assigns the processes and schedules the coroutines on the event loop, a slot is taken
+        # for every process and released when it has been closed
+        self.local.workerid = 0
+        self.local.stats = self.stats[0]
+        while not self.stopped():
+            if self.prefetch == 0 and not self.slots.acquire(timeout=0.5):
+                continue
+            process = self.next_process()
+            if process is None:
+                if self.prefetch == 0:
+                    self.slots.release()
+                continue
+
+            self.on_assigned(process)
+            started = time.time()
+            output, err = None, None
+            try:
+                handler, key, output = self.lookup(process)
+                if output is None:
+                    if inspect.iscoroutinefunction(handler):
+                        future = asyncio.run_coroutine_threadsafe(handler(process), self.loop)
+                        future.add_done_callback(partial(self.done, process, key, started))
+                        continue
+                    output = handler(process)
+                    self.remember(process, key, output)
+            except Exception as e:
+                err = e
+                print(err)
+            self.finish(process, started, output, err)
+
+    def done(self, process, key, started, future):
+        # called on the event loop when the coroutine of a process has returned
+        output, err = None, None
+        try:
+            output = future.result()
+            self.remember(process, key, output)
+        except Exception as e:
+            err = e
+            print(err)
+        self.finish(process, started, output, err)
+
+    def finish(self, process, started, output, err):
+        self.complete(process, output, err)
+        elapsed = time.time() - started
+        with self.stats_lock:
+            stats = self.local.stats
+            stats["processes" if err is None else "errors"] += 1
+            stats["busy"] += elapsed
+        self.on_finished(process, elapsed, err)
+
+    def run_loop(self):
+        # count() called by a coroutine adds to the statistics of worker 0
+        self.local.workerid = 0
+        self.local.stats = self.stats[0]
+        self.loop.run_forever()
+
+    def start(self):
+        if self.pool_mode == "process":
+            self.offload_pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_offload_worker)
+        if self.pool_mode == "asyncio" or any(inspect.iscoroutinefunction(f) for f in self.functions.values()):
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.run_loop, daemon=True).start()
+        if self.prefetch > 0 or self.pool_mode == "asyncio":
+            # the event loop must not wait for the close requests
+            self.closer = ThreadPoolExecutor(max_workers=self.prefetch or self.workers)
+        if self.prefetch > 0:
+            self.assigners = [threading.Thread(target=self.assigner, daemon=True) for _ in range(self.prefetch)]
+            for thread in self.assigners:
+                thread.start()
+
+        if self.pool_mode == "asyncio":
+            threads = [threading.Thread(target=self.dispatcher, daemon=True)]
+        else:
+            threads = [threading.Thread(target=self.worker, args=(workerid,), daemon=True) for workerid in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        print("Started", self.workers, "workers in", self.pool_mode, "pool mode, prefetching", self.prefetch, "processes")
+
+        # join with a timeout, so that the main thread can still receive signals
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+        if self.pool_mode == "asyncio":
+            # the processes still on the event loop hold a slot until they have been closed
+            for _ in range(self.workers + self.prefetch):
+                while not self.slots.acquire(timeout=0.5):
+                    pass
+
+        if self.closer is not None:
+            self.closer.shutdown()
+        if self.offload_pool is not None:
+            self.offload_pool.shutdown()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+        self.print_stats()
+        self.unregister()
+
+    def stop(self):
+        print("Stopping executor, waiting for in-flight processes to finish (ctrl-c again to force)")
+        self.stop_event.set()
+
+    def print_stats(self):
+        for workerid, stats in enumerate(self.stats):
+            print(f"Worker {workerid}: " + ", ".join(f"{name} {value:.2f}s" if isinstance(value, float) else f"{value} {name}"
+                                                     for name, value in stats.items()))
+        with self.timings_lock:
+            for funcname, timing in self.timings.items():
+                print(f"Function {funcname}: {timing['calls']} calls, mean {timing['total'] / timing['calls'] * 1000:.2f}ms, "
+                      f"max {timing['max'] * 1000:.2f}ms")
+
+    def unregister(self):
+        try:
+            self.colonies.remove_executor(self.colonyname, self.executorname, self.colony_prvkey)
+            print("Executor", self.executorname, "unregistered")
+        except Exception as err:
+            print(err)
+
+    def install_signal_handlers(self):
+        def sigint_handler(signum, frame):
+            if self.stop_event.is_set():
+                self.unregister()
+                os._exit(1)
+            self.stop()
+
+        signal.signal(signal.SIGINT, sigint_handler)
@@ -1,66 +1,15 @@
-from pycolonies import Crypto
-from pycolonies import colonies_client
-import signal
-import os
+from colonies_executor import Executor, function
 
-class PythonExecutor:
+class PythonExecutor(Executor):
     def __init__(self):
-        colonies, colonyname, colony_prvkey, _, _ = colonies_client()
-        self.colonies = colonies
-        self.colonyname = colonyname
-        self.colony_prvkey = colony_prvkey
-        self.executorname = "helloworld-executor"
-        self.executortype = "helloworld-executor"
+        super().__init__("helloworld-executor", executorname="helloworld-executor")
 
-        crypto = Crypto()
-        self.executor_prvkey = crypto.prvkey()
-        self.executorid = crypto.id(self.executor_prvkey)
-
-        self.register()
-        
-    def register(self):
-        executor = {
-            "executorname": self.executorname,
-            "executorid": self.executorid,
-            "colonyname": self.colonyname,
-            "executortype": self.executortype
-        }
-        
-        try:
-            executor = self.colonies.add_executor(executor, self.colony_prvkey)
-            self.colonies.approve_executor(self.colonyname, self.executorname, self.colony_prvkey)
-            
-            self.colonies.add_function(self.colonyname, 
-                                       self.executorname, 
-                                       "helloworld",  
-                                       self.executor_prvkey)
-        except Exception as err:
-            print(err)
-            os._exit(0)
-        
-        print("Executor", self.executorname, "registered")
-        
-    def start(self):
-        while (True):
-            try:
-                process = self.colonies.assign(self.colonyname, 10, self.executor_prvkey)
-                print("Process", process.processid, "is assigned to executor")
-                self.colonies.add_log(process.processid, "Hello from executor\n", self.executor_prvkey)
-                if process.spec.funcname == "helloworld":
-                    self.colonies.close(process.processid, ["helloworld"], self.executor_prvkey)
-            except Exception as err:
-                print(err)
-                pass
-
-    def unregister(self):
-        self.colonies.remove_executor(self.colonyname, self.executorname, self.colony_prvkey)
-        print("Executor", self.executorname, "unregistered")
-        os._exit(0)
-
-def sigint_handler(signum, frame):
-    executor.unregister()
+    @function("helloworld")
+    def helloworld(self, process):
+        self.colonies.add_log(process.processid, "Hello from executor\n", self.executor_prvkey)
+        return ["helloworld"]
 
 if __name__ == '__main__':
-    signal.signal(signal.SIGINT, sigint_handler)
     executor = PythonExecutor()
+    executor.install_signal_handlers()
     executor.start()
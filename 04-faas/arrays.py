@@ -0,0 +1,22 @@
+import base64
+import io
+import numpy as np
+
+# NumPy arrays are sent to and from the FaaS executor in the NPY format, either inline in the function
+# spec (base64 encoded) or as a file in ColonyFS for arrays that are too large for a function spec.
+
+CONTENT_TYPE = "application/x-npy"
+
+def to_npy(array):
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(array), allow_pickle=False)
+    return buf.getvalue()
+
+def from_npy(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+def encode(array):
+    return base64.b64encode(to_npy(array)).decode("ascii")
+
+def decode(data):
+    return from_npy(base64.b64decode(data))
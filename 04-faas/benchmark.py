@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# Measures the latency of the /convert endpoint, from frontend.py through the colony to faas_executor.py.
+#
+# By default the frontend and a FaaS executor are started in this process, connected to LocalColony, a
+# stand-in for the Colonies server that records when every process is submitted, assigned and closed. The
+# requests are sent open-loop: request i is sent at time i / rate whether or not earlier requests have
+# completed, and its latency is measured from that time, so a slow system cannot slow down the load.
+#
+# The time of every process is split into submit (the submit call), queue (waiting for an executor), assign
+# (the assign call), exec (fetching the function and executing it), close (the close call) and notify (until
+# the frontend's wait call returns). The difference between the request latency and the sum of the phases
+# is spent in the frontend, e.g. waiting for a batch to fill up.
+#
+# With --url, the requests are sent to a running frontend instead, and only the end-to-end latency is measured.
+
+def convert(celsius):
+    return (celsius * 9/5) + 32
+
+class LocalColony:
+    # implements the part of the Colonies API used by frontend.py and faas_executor.py, every call takes rpc_latency seconds
+    def __init__(self, rpc_latency=0.0):
+        self.rpc_latency = rpc_latency
+        self.queue = queue.Queue()
+        self.processes = {}
+        self.files = {}  # (label, filename) -> data
+        self.lock = threading.Lock()
+
+    def rpc(self):
+        if self.rpc_latency > 0:
+            time.sleep(self.rpc_latency)
+
+    def submit_func_spec(self, spec, prvkey):
+        called = time.time()
+        self.rpc()
+        process = SimpleNamespace(processid=os.urandom(16).hex(), spec=spec, output=None, errors=None,
+                                  done=threading.Event(), times={"submit_called": called})
+        with self.lock:
+            self.processes[process.processid] = process
+        process.times["submitted"] = time.time()
+        self.queue.put(process)
+        return process
+
+    def assign(self, colonyname, timeout, prvkey):
+        try:
+            process = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            raise Exception("No process assigned before timeout")
+        process.times["dequeued"] = time.time()
+        self.rpc()
+        process.times["assigned"] = time.time()
+        return process
+
+    def close(self, processid, output, prvkey):
+        self.finish(processid, output, None)
+
+    def fail(self, processid, errors, prvkey):
+        self.finish(processid, None, errors)
+
+    def finish(self, processid, output, errors):
+        process = self.processes[processid]
+        process.times["close_called"] = time.time()
+        self.rpc()
+        process.output = output
+        process.errors = errors
+        process.times["closed"] = time.time()
+        process.done.set()
+
+    def wait(self, process, timeout, prvkey):
+        process.done.wait(timeout)
+        self.rpc()
+        process.times["waited"] = time.time()
+        return process
+
+    def get_file(self, colonyname, prvkey, label=None, filename=None):
+        self.rpc()
+        if (label, filename) not in self.files:
+            return []
+        return [{"fileid": label + ":" + filename, "checksum": hashlib.sha256(self.files[(label, filename)]).hexdigest()}]
+
+    def download_data(self, colonyname, prvkey, label=None, filename=None, fileid=None):
+        self.rpc()
+        if fileid is not None:
+            label, filename = fileid.split(":", 1)
+        return self.files[(label, filename)]
+
+    def upload_data(self, colonyname, prvkey, filename=None, data=None, label=None):
+        self.rpc()
+        self.files[(label, filename)] = data
+
+    def add_executor(self, executor, prvkey):
+        return executor
+
+    def approve_executor(self, colonyname, executorname, prvkey):
+        pass
+
+    def add_function(self, colonyname, executorname, funcname, prvkey):
+        pass
+
+    def remove_executor(self, colonyname, executorname, prvkey):
+        pass
+
+    def add_log(self, processid, msg, prvkey):
+        self.rpc()
+
+    def phases(self):
+        # seconds spent by every process in each phase
+        phases = {"submit": [], "queue": [], "assign": [], "exec": [], "close": [], "notify": []}
+        for process in self.processes.values():
+            times = process.times
+            if "waited" not in times or "assigned" not in times:
+                continue
+            phases["submit"].append(times["submitted"] - times["submit_called"])
+            phases["queue"].append(times["dequeued"] - times["submitted"])
+            phases["assign"].append(times["assigned"] - times["dequeued"])
+            phases["exec"].append(times["close_called"] - times["assigned"])
+            phases["close"].append(times["closed"] - times["close_called"])
+            phases["notify"].append(times["waited"] - times["closed"])
+        return phases
+
+def summarize(values):
+    if len(values) == 0:
+        return None
+    values = np.asarray(values) * 1000
+    return {"mean": float(np.mean(values)), "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99)), "max": float(np.max(values))}
+
+async def run_load(client, rate, duration, distinct, poisson):
+    # sends rate requests per second during duration seconds, returns the latencies and the number of errors
+    latencies = []
+    errors = 0
+
+    async def request(scheduled, celsius):
+        nonlocal errors
+        await asyncio.sleep(max(0, scheduled - time.time()))
+        try:
+            response = await client.get("/convert", params={"celsius": celsius})
+            if response.status_code != 200:
+                errors += 1
+                return
+        except Exception:
+            errors += 1
+            return
+        latencies.append(time.time() - scheduled)
+
+    start = time.time() + 0.1
+    scheduled = start
+    tasks = []
+    while scheduled < start + duration:
+        celsius = random.randrange(distinct) if distinct > 0 else random.uniform(-30, 40)
+        tasks.append(asyncio.create_task(request(scheduled, celsius)))
+        scheduled += random.expovariate(rate) if poisson else 1 / rate
+    await asyncio.gather(*tasks)
+    elapsed = time.time() - start
+    return latencies, errors, len(tasks), elapsed
+
+async def benchmark(args, app, colony):
+    import httpx
+
+    if args.url is not None:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30, limits=httpx.Limits(max_connections=1000))
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://frontend", timeout=30)
+
+    results = []
+    async with client:
+        for rate in args.rates:
+            if colony is not None:
+                colony.processes.clear()
+            latencies, errors, sent, elapsed = await run_load(client, rate, args.duration, args.distinct, args.poisson)
+            result = {
+                "rate": rate,
+                "requests": sent,
+                "errors": errors,
+                "throughput": len(latencies) / elapsed,
+                "latency_ms": summarize(latencies)
+            }
+            if colony is not None:
+                phases = colony.phases()
+                result["processes"] = len(phases["exec"])
+                result["phases_ms"] = {phase: summarize(values) for phase, values in phases.items()}
+            results.append(result)
+            print_result(result)
+    return results
+
+def print_result(result):
+    latency = result["latency_ms"] or {"p50": float("nan"), "p95": float("nan"), "p99": float("nan")}
+    print(f"rate {result['rate']}/s: {result['requests']} requests, {result['errors']} errors, throughput {result['throughput']:.1f}/s, "
+          f"latency p50 {latency['p50']:.2f}ms p95 {latency['p95']:.2f}ms p99 {latency['p99']:.2f}ms")
+    if "phases_ms" in result:
+        print(f"  {result['processes']} processes, p50 per phase: " +
+              ", ".join(f"{phase} {summary['p50']:.2f}ms" for phase, summary in result["phases_ms"].items() if summary is not None))
+
+def start_local(args):
+    # the environment is read by frontend.py and faas_executor.py when they are imported
+    os.environ["FAAS_WORKERS"] = str(args.workers)
+    os.environ["FAAS_BATCH_WINDOW"] = str(args.batch_window)
+    os.environ["FAAS_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["FAAS_PREFETCH"] = str(args.prefetch)
+    os.environ["FAAS_CODE_CACHE"] = tempfile.mkdtemp(prefix="faas-benchmark-")
+    if args.no_result_cache:
+        os.environ["FAAS_RESULT_CACHE_SIZE"] = "0"
+
+    colony = LocalColony(rpc_latency=args.rpc_latency / 1000)
+    import pycolonies
+    pycolonies.colonies_client = lambda: (colony, "benchmark", "", "", "")
+
+    import package
+    colony.upload_data("benchmark", "", filename="convert", data=package.build(convert, pure=args.pure), label="/faas")
+
+    import faas_executor
+    import colonies_executor
+    colonies_executor.print = lambda *args: None
+    executor = faas_executor.FaaSExecutor()
+    threading.Thread(target=executor.start, daemon=True).start()
+
+    import frontend
+    frontend.print = lambda *args: None
+    return colony, frontend.app, executor
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the latency of the FaaS frontend and executor")
+    parser.add_argument("--url", default=None, help="URL of a running frontend, by default a local frontend and executor are used")
+    parser.add_argument("--rates", default="100,500,1000", help="comma separated list of request rates (requests/s)")
+    parser.add_argument("--duration", type=float, default=5, help="seconds to send requests at every rate")
+    parser.add_argument("--poisson", action="store_true", help="exponentially distributed time between requests instead of fixed")
+    parser.add_argument("--distinct", type=int, default=0, help="number of distinct arguments, 0 for random arguments")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of executor worker processes")
+    parser.add_argument("--batch-window", type=float, default=5, help="frontend batch window in milliseconds")
+    parser.add_argument("--batch-size", type=int, default=256, help="frontend batch size, 1 disables batching")
+    parser.add_argument("--prefetch", type=int, default=0, help="number of processes the executor assigns ahead of time")
+    parser.add_argument("--pure", action="store_true", help="deploy convert as a pure function, so that results are cached")
+    parser.add_argument("--no-result-cache", action="store_true", help="disable the result cache")
+    parser.add_argument("--rpc-latency", type=float, default=1, help="simulated latency of every Colonies call in milliseconds")
+    parser.add_argument("--output", default="benchmark.json", help="file to write the results to")
+    args = parser.parse_args()
+    args.rates = [float(rate) for rate in args.rates.split(",")]
+
+    colony, app, executor = (None, None, None) if args.url is not None else start_local(args)
+    results = asyncio.run(benchmark(args, app, colony))
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    with open(args.output, "w") as f:
+        json.dump({"config": config, "time": time.time(), "results": results}, f, indent=4)
+    print("Results written to", args.output)
+
+    if executor is not None:
+        executor.function_cache.print_stats()
+        executor.result_cache.print_stats()
+        executor.pool.print_stats()
@@ -0,0 +1,36 @@
+import numpy as np
+from pycolonies import FuncSpec, Conditions, colonies_client
+import arrays
+
+colonies, colonyname, colony_prvkey, executor_name, prvkey = colonies_client()
+
+# one million temperature readings, converted by a single process
+celsius = np.random.uniform(-30, 40, 1_000_000)
+
+# the array is too large for a function spec, so it is stored in ColonyFS
+colonies.upload_data(colonyname, prvkey, filename="readings.npy", data=arrays.to_npy(celsius), label="/faas/data")
+
+func_spec = FuncSpec(
+    funcname="execute",
+    kwargs={
+        "function": "convert",
+        "arrayfile": "readings.npy",
+        "label": "/faas/data"
+    },
+    conditions=Conditions(
+        colonyname=colonyname,
+        executortype="faas-executor",
+    )
+)
+
+process = colonies.submit_func_spec(func_spec, prvkey)
+print("Process", process.processid, "submitted")
+
+process = colonies.wait(process, 60, prvkey)
+if process.output is None:
+    raise Exception("Process execution failed or timed out")
+
+# the result is stored next to the readings, the process output is its filename
+result = colonies.download_data(colonyname, prvkey, label="/faas/data", filename=process.output[0])
+fahrenheit = arrays.from_npy(result)
+print("Converted", len(fahrenheit), "readings, first reading", celsius[0], "C =", fahrenheit[0], "F")
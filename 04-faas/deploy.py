@@ -1,9 +1,15 @@
-import inspect
 from pycolonies import colonies_client
+import package
 
 def convert(celsius):
     return (celsius * 9/5) + 32
 
 colonies, colonyname, colony_prvkey, executor_name, prvkey = colonies_client()
-source_code = inspect.getsource(convert)
-colonies.upload_data(colonyname, prvkey, filename="convert", data=source_code.encode('utf-8'), label="/faas")
+
+def deploy(function, pure=False, data=None):
+    # the function is stored as an archive with the helpers it uses and a manifest, see package.py. The results
+    # of pure functions only depend on the arguments, so they can be cached, see result_cache.py
+    archive = package.build(function, pure=pure, data=data)
+    colonies.upload_data(colonyname, prvkey, filename=function.__name__, data=archive, label="/faas")
+
+deploy(convert, pure=True)
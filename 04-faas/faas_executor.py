@@ -1,83 +1,103 @@
-from pycolonies import Crypto
-from pycolonies import colonies_client
-import signal
 import os
 import uuid
+import arrays
+from colonies_executor import Executor, function
+from function_cache import FunctionCache
+from result_cache import ResultCache
+from worker_pool import WorkerPool
 
-class FaaSExecutor:
+class FaaSExecutor(Executor):
     def __init__(self):
-        colonies, colonyname, colony_prvkey, _, _ = colonies_client()
-        self.colonies = colonies
-        self.colonyname = colonyname
-        self.colony_prvkey = colony_prvkey
-        self.executorname = "faas-executor" + uuid.uuid4().hex[:6]
-        self.executortype = "faas-executor"
-
-        crypto = Crypto()
-        self.executor_prvkey = crypto.prvkey()
-        self.executorid = crypto.id(self.executor_prvkey)
-
-        self.register()
-        
-    def register(self):
-        executor = {
-            "executorname": self.executorname,
-            "executorid": self.executorid,
-            "colonyname": self.colonyname,
-            "executortype": self.executortype
-        }
-        
-        try:
-            executor = self.colonies.add_executor(executor, self.colony_prvkey)
-            self.colonies.approve_executor(self.colonyname, self.executorname, self.colony_prvkey)
-            
-            self.colonies.add_function(self.colonyname, 
-                                       self.executorname, 
-                                       "execute",  
-                                       self.executor_prvkey)
-        except Exception as err:
-            print(err)
-            os._exit(0)
-        
-        print("Executor", self.executorname, "registered")
-        
-    def start(self):
-        while (True):
-            try:
-                process = self.colonies.assign(self.colonyname, 10, self.executor_prvkey)
-                print("Process", process.processid, "is assigned to executor")
-                self.colonies.add_log(process.processid, "Executing function \n", self.executor_prvkey)
-
-                if process.spec.funcname == "execute":
-                    # parse function spec
-                    function = process.spec.kwargs["function"] 
-                    arg = process.spec.kwargs["arg"]
-
-                    # fetch source code
-                    source_code = self.colonies.download_data(self.colonyname, self.executor_prvkey, label="/faas", filename=function)
-                    source_code_str = source_code.decode('utf-8')
-
-                    # call the function
-                    namespace = {}
-                    exec(source_code_str, globals(), namespace)
-                    f = namespace[function]
-                    r = f(float(arg))
-
-                    self.colonies.close(process.processid, [r], self.executor_prvkey)
-
-            except Exception as err:
-                print(err)
-                pass
+        # functions are executed in worker processes, one assign loop per worker, see worker_pool.py
+        workers = int(os.getenv("FAAS_WORKERS", str(os.cpu_count())))
+        self.pool = WorkerPool(size=workers, max_calls=int(os.getenv("FAAS_MAX_CALLS", "1000")))
 
-    def unregister(self):
-        self.colonies.remove_executor(self.colonyname, self.executorname, self.colony_prvkey)
-        print("Executor", self.executorname, "unregistered")
-        os._exit(0)
+        # FAAS_PREFETCH processes are assigned ahead of time, so that the workers do not wait for the Colonies server
+        super().__init__("faas-executor", executorname="faas-executor" + uuid.uuid4().hex[:6], workers=workers,
+                         prefetch=int(os.getenv("FAAS_PREFETCH", "0")))
+
+        # functions are downloaded once and unpacked into a local directory, see function_cache.py
+        self.function_cache = FunctionCache(self.colonies, self.colonyname, self.executor_prvkey,
+                                            max_size=int(os.getenv("FAAS_CACHE_SIZE", "128")),
+                                            ttl=float(os.getenv("FAAS_CACHE_TTL", "5")),
+                                            code_dir=os.getenv("FAAS_CODE_CACHE", os.path.expanduser("~/.cache/colonies-faas")))
+        self.result_cache = ResultCache(max_size=int(os.getenv("FAAS_RESULT_CACHE_SIZE", "100000")),
+                                        ttl=float(os.getenv("FAAS_RESULT_CACHE_TTL", "300")))
+
+    @function("execute")
+    def execute_function(self, process):
+        self.colonies.add_log(process.processid, "Executing function \n", self.executor_prvkey)
+
+        # parse function spec
+        name = process.spec.kwargs["function"]
+
+        # fetch the source code, unless the function is cached
+        entry = self.function_cache.get_entry(name)
+
+        # call the function in a worker process, the calls are aborted after maxexectime seconds
+        timeout = process.spec.maxexectime if process.spec.maxexectime > 0 else None
+        if "array" in process.spec.kwargs or "arrayfile" in process.spec.kwargs:
+            return [self.call_array(process, name, entry, timeout)]
+
+        # a batch of calls (see frontend.py) sets args instead of arg. The output has one ["ok", result] or
+        # ["error", message] pair per argument, so an argument that fails does not fail the whole batch
+        if "args" in process.spec.kwargs:
+            args = [float(arg) for arg in process.spec.kwargs["args"]]
+            return [list(result) for result in self.call_batch(entry, args, timeout)]
+
+        status, result = self.call_batch(entry, [float(process.spec.kwargs["arg"])], timeout)[0]
+        if status == "error":
+            raise Exception(result)
+        return [result]
 
-def sigint_handler(signum, frame):
-    executor.unregister()
+    def call_batch(self, entry, args, timeout):
+        if "pure" in entry["options"]:
+            return self.call_pure(entry, args, timeout)
+        return self.pool.call_many(entry, args, timeout=timeout)
+
+    def call_array(self, process, name, entry, timeout):
+        # the function is called once with the whole NumPy array, see arrays.py. An inline array (array) gives an
+        # inline result, an array stored in ColonyFS (arrayfile, label) gives a result stored next to it
+        kwargs = process.spec.kwargs
+        if "array" in kwargs:
+            result = self.pool.call(entry, arrays.decode(kwargs["array"]), timeout=timeout)
+            return arrays.encode(result)
+
+        label = kwargs.get("label", "/faas/data")
+        data = self.colonies.download_data(self.colonyname, self.executor_prvkey, label=label, filename=kwargs["arrayfile"])
+        result = self.pool.call(entry, arrays.from_npy(data), timeout=timeout)
+        filename = name + "-" + process.processid + ".npy"
+        self.colonies.upload_data(self.colonyname, self.executor_prvkey, filename=filename, data=arrays.to_npy(result), label=label)
+        return filename
+
+    def call_pure(self, entry, args, timeout):
+        # only the arguments without a cached result are sent to a worker, and only successful results are cached
+        cached = [self.result_cache.get(entry["checksum"], arg) for arg in args]
+        missing = [arg for arg, (hit, _) in zip(args, cached) if not hit]
+        computed = iter(self.pool.call_many(entry, missing, timeout=timeout) if missing else [])
+
+        results = []
+        for arg, (hit, result) in zip(args, cached):
+            if hit:
+                results.append(("ok", result))
+                continue
+            status, result = next(computed)
+            if status == "ok":
+                self.result_cache.put(entry["checksum"], arg, result)
+            results.append((status, result))
+        return results
+
+    def print_stats(self):
+        super().print_stats()
+        self.function_cache.print_stats()
+        self.result_cache.print_stats()
+        self.pool.print_stats()
+
+    def unregister(self):
+        self.pool.close()
+        super().unregister()
 
 if __name__ == '__main__':
-    signal.signal(signal.SIGINT, sigint_handler)
     executor = FaaSExecutor()
+    executor.install_signal_handlers()
     executor.start()
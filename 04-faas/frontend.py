@@ -1,37 +1,203 @@
-from fastapi import FastAPI, HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, Response
 from pycolonies import FuncSpec, Conditions, colonies_client
+import asyncio
+import json
+import os
+import numpy as np
+import arrays
+from function_cache import FunctionCache
+from result_cache import ResultCache
 
 app = FastAPI()
 
 colonies, colonyname, colony_prvkey, executor_name, prvkey = colonies_client()
 
-@app.get("/convert")
-def convert(celsius: float):
-    # Define the function specification
-    func_spec = FuncSpec(
-        funcname="execute",
-        kwargs={
-            "function": "convert",
-            "arg": str(float(celsius))
-        },
-        conditions=Conditions(
-            colonyname=colonyname,
-            executortype="faas-executor",
+class Overloaded(Exception):
+    pass
+
+# Requests arriving within window seconds, at most max_size of them, are sent to the FaaS executor as a
+# single process with a list of arguments. The executor returns one result or error per argument, which are
+# passed back to the waiting requests, so a bad argument only fails its own request.
+#
+# Waiting requests do not use any threads, only the batches are submitted and waited for in a thread
+# pool, since the Colonies SDK is blocking. At most max_pending requests can wait at the same time,
+# more requests are rejected so that the response time stays bounded.
+#
+# If the function is pure (see deploy.py), results are cached and repeated arguments are answered without
+# submitting a process.
+class Batcher:
+    def __init__(self, function, window=0.005, max_size=256, timeout=10, concurrency=32, max_pending=10000,
+                 function_cache=None, result_cache=None):
+        self.function = function
+        self.function_cache = function_cache
+        self.result_cache = result_cache
+        self.window = window
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self.queue = asyncio.Queue()
+        self.submitters = ThreadPoolExecutor(max_workers=concurrency)
+        self.collector = None
+        self.dispatchers = set()
+
+    async def call(self, arg):
+        entry = await self.lookup()
+        pure = entry is not None and "pure" in entry["options"]
+        if pure:
+            hit, result = self.result_cache.get(entry["checksum"], arg)
+            if hit:
+                return result
+
+        result = await self.submit(arg)
+        if pure:
+            self.result_cache.put(entry["checksum"], arg, result)
+        return result
+
+    async def lookup(self):
+        # the function's checksum and options, the Colonies server is only contacted when the cached entry has expired
+        if self.function_cache is None or self.result_cache is None:
+            return None
+        entry = self.function_cache.peek(self.function)
+        if entry is not None:
+            return entry
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self.function_cache.get_entry, self.function)
+        except Exception as err:
+            print("Failed to look up function", self.function, err)
+            return None
+
+    async def call_array(self, array):
+        # arrays are not batched, the function is applied to the whole array in a single process
+        if self.pending >= self.max_pending:
+            raise Overloaded(f"Too many pending requests ({self.pending})")
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.submitters, self.execute_array, array)
+        finally:
+            self.pending -= 1
+
+    async def submit(self, arg):
+        if self.pending >= self.max_pending:
+            raise Overloaded(f"Too many pending requests ({self.pending})")
+        if self.collector is None:
+            self.collector = asyncio.create_task(self.collect())
+
+        self.pending += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait((arg, future))
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            dispatcher = asyncio.create_task(self.dispatch(batch))
+            self.dispatchers.add(dispatcher)
+            dispatcher.add_done_callback(self.dispatchers.discard)
+
+    async def dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.submitters, self.execute, [arg for arg, _ in batch])
+            for (_, future), (status, result) in zip(batch, results):
+                if future.done():  # the request may have been cancelled
+                    continue
+                if status == "ok":
+                    future.set_result(result)
+                else:
+                    future.set_exception(Exception(result))
+        except Exception as err:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+
+    def execute(self, args):
+        # one (status, result) pair per argument
+        return self.run({"args": [str(arg) for arg in args]}, len(args))
+
+    def execute_array(self, array):
+        return arrays.decode(self.run({"array": arrays.encode(array)}, 1)[0])
+
+    def run(self, kwargs, num_results):
+        # Define the function specification
+        func_spec = FuncSpec(
+            funcname="execute",
+            kwargs=dict(kwargs, function=self.function),
+            conditions=Conditions(
+                colonyname=colonyname,
+                executortype="faas-executor",
+            )
         )
-    )
 
-    # Submit the function specification to the colonies
-    process = colonies.submit_func_spec(func_spec, prvkey)
-    print("Process", process.processid, "submitted")
+        # Submit the function specification to the colonies
+        process = colonies.submit_func_spec(func_spec, prvkey)
+        print("Process", process.processid, "submitted")
+
+        # Wait for the process to be executed
+        process = colonies.wait(process, self.timeout, prvkey)
+
+        # Check if the process has completed successfully
+        if process.output is None or len(process.output) != num_results:
+            raise Exception("Process execution failed or timed out")
+
+        return process.output
+
+convert_batcher = Batcher("convert",
+                          window=float(os.getenv("FAAS_BATCH_WINDOW", "5")) / 1000,
+                          max_size=int(os.getenv("FAAS_BATCH_SIZE", "256")),
+                          max_pending=int(os.getenv("FAAS_MAX_PENDING", "10000")),
+                          function_cache=FunctionCache(colonies, colonyname, prvkey, ttl=float(os.getenv("FAAS_CACHE_TTL", "5"))),
+                          result_cache=ResultCache(max_size=int(os.getenv("FAAS_RESULT_CACHE_SIZE", "100000")),
+                                                   ttl=float(os.getenv("FAAS_RESULT_CACHE_TTL", "300"))))
+
+@app.get("/convert")
+async def convert(celsius: float):
+    try:
+        fahrenheit = await convert_batcher.call(float(celsius))
+    except Overloaded as err:
+        raise HTTPException(status_code=503, detail=str(err), headers={"Retry-After": "1"})
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+    return {"fahrenheit": [fahrenheit]}
+
+# The Celsius values are sent either as a JSON list, or as a NumPy array in the NPY format (Content-Type
+# application/x-npy), and the Fahrenheit values are returned in the same format
+@app.post("/convert/array")
+async def convert_array(request: Request):
+    body = await request.body()
+    binary = request.headers.get("content-type", "").startswith(arrays.CONTENT_TYPE)
+    try:
+        celsius = arrays.from_npy(body) if binary else np.asarray(json.loads(body), dtype=np.float64)
+    except Exception as err:
+        raise HTTPException(status_code=400, detail=f"Invalid array: {err}")
 
-    # Wait for the process to be executed, timeout after 10 seconds
-    process = colonies.wait(process, 10, prvkey)
+    try:
+        fahrenheit = await convert_batcher.call_array(celsius)
+    except Overloaded as err:
+        raise HTTPException(status_code=503, detail=str(err), headers={"Retry-After": "1"})
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=str(err))
 
-    # Check if the process has completed successfully
-    if process.output is None:
-        raise HTTPException(status_code=500, detail="Process execution failed or timed out")
-    
-    return {"fahrenheit": process.output}
+    if binary:
+        return Response(content=arrays.to_npy(fahrenheit), media_type=arrays.CONTENT_TYPE)
+    return {"fahrenheit": fahrenheit.tolist()}
 
 # Run the application
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+import package
+
+# Cache of the functions stored in ColonyFS, keyed by function name and the checksum of the stored file.
+#
+# A cached function is used without contacting the Colonies server for ttl seconds. After that, the file
+# metadata is fetched to compare checksums, and the function is only downloaded again if it has been
+# redeployed, e.g. by running deploy.py again. The least recently used functions are evicted when more
+# than max_size functions are cached.
+#
+# If code_dir is set, the functions are unpacked into code_dir/<checksum>, see package.py, where the worker
+# processes import them from. The directory is kept when the executor is restarted, so a new executor only
+# has to fetch the checksums of the functions it has already seen.
+
+class FunctionCache:
+    def __init__(self, colonies, colonyname, prvkey, label="/faas", max_size=128, ttl=5.0, code_dir=None):
+        self.colonies = colonies
+        self.colonyname = colonyname
+        self.prvkey = prvkey
+        self.label = label
+        self.max_size = max_size
+        self.ttl = ttl
+        self.code_dir = code_dir
+
+        self.entries = OrderedDict()  # function name -> {"checksum", "manifest", "options", "path", "checked"}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "revalidations": 0, "disk_hits": 0, "evictions": 0}
+
+    def peek(self, name):
+        # returns the entry if it can be used without contacting the Colonies server, otherwise None
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and time.time() - entry["checked"] < self.ttl:
+                self.entries.move_to_end(name)
+                self.stats["hits"] += 1
+                return entry
+            return None
+
+    def get_entry(self, name):
+        entry = self.peek(name)
+        if entry is not None:
+            return entry
+
+        files = self.colonies.get_file(self.colonyname, self.prvkey, label=self.label, filename=name)
+        if len(files) == 0:
+            raise Exception(f"Function {name} not found in {self.label}")
+        checksum = files[0]["checksum"]
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry["checksum"] == checksum:
+                entry["checked"] = time.time()
+                self.entries.move_to_end(name)
+                self.stats["revalidations"] += 1
+                return entry
+
+        path = os.path.join(self.code_dir, checksum) if self.code_dir is not None else None
+        if path is not None and os.path.isdir(path):
+            manifest = package.load_manifest(name, path)
+            stat = "disk_hits"
+        else:
+            # new or redeployed function, the file ID makes sure the data matches the checksum
+            data = self.colonies.download_data(self.colonyname, self.prvkey, fileid=files[0]["fileid"])
+            manifest = package.read_manifest(name, data)
+            if path is not None:
+                package.unpack(data, path)
+            stat = "misses"
+
+        entry = {"checksum": checksum, "manifest": manifest, "options": set(manifest["options"]), "path": path, "checked": time.time()}
+        with self.lock:
+            self.stats[stat] += 1
+            self.entries[name] = entry
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, name=None):
+        with self.lock:
+            if name is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(name, None)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, size=len(self.entries))
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"Function cache: {stats['size']} functions, {stats['hits']} hits, {stats['revalidations']} revalidations, "
+              f"{stats['disk_hits']} disk hits, {stats['misses']} misses, {stats['evictions']} evictions")
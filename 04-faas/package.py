@@ -0,0 +1,152 @@
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import zipfile
+
+# A deployed function is stored in ColonyFS as a zip archive:
+#
+#   manifest.json   name, entry point, imports, content hash and options of the function
+#   function.py     the function, and the helpers, constants and imports it uses from its module
+#   data/...        data files, the function finds them next to __file__
+#
+# The archive is built the same way every time, so deploying an unchanged function gives the same
+# checksum in ColonyFS. Functions stored as plain source code (see faas/convert) are also supported.
+
+MANIFEST = "manifest.json"
+SOURCE = "function.py"
+
+def parse_options(source_code):
+    # options of plain source code are set in comments at the top, e.g. "# faas: pure"
+    options = set()
+    for line in source_code.splitlines():
+        if not line.startswith("# faas:"):
+            break
+        options.update(line[len("# faas:"):].split())
+    return options
+
+def referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= referenced_names(const)
+    return names
+
+def collect(function):
+    # returns the import lines, constant lines and source code of the definitions needed by function
+    imports, constants, definitions = {}, {}, {}
+    pending = [function]
+    while pending:
+        obj = pending.pop()
+        codes = [obj.__code__] if inspect.isfunction(obj) else [f.__code__ for f in vars(obj).values() if inspect.isfunction(f)]
+        for name in sorted(set().union(*[referenced_names(code) for code in codes])):
+            if name not in function.__globals__ or name in definitions or name in imports or name in constants:
+                continue
+            if name.startswith("__"):  # module attributes like __file__ are set when the function is imported
+                continue
+            value = function.__globals__[name]
+            if inspect.ismodule(value):
+                imports[name] = f"import {value.__name__}" + (f" as {name}" if name != value.__name__ else "")
+            elif (inspect.isfunction(value) or inspect.isclass(value)) and value.__module__ == function.__module__:
+                definitions[name] = value
+                pending.append(value)
+            elif inspect.isfunction(value) or inspect.isclass(value) or inspect.isbuiltin(value):
+                imports[name] = f"from {value.__module__} import {value.__name__}" + (f" as {name}" if name != value.__name__ else "")
+            elif isinstance(value, (bool, int, float, str, bytes, tuple, list, dict, type(None))):
+                constants[name] = f"{name} = {value!r}"
+            else:
+                raise ValueError(f"Function {function.__name__} uses {name}, which cannot be packaged")
+
+    definitions[function.__name__] = function
+    ordered = sorted(definitions.values(), key=lambda obj: inspect.getsourcelines(obj)[1])
+    return sorted(imports.values()), sorted(constants.values()), [inspect.getsource(obj) for obj in ordered]
+
+def build(function, pure=False, data=None):
+    imports, constants, definitions = collect(function)
+    source_code = "\n".join(imports + [""] + constants + [""] + definitions).lstrip("\n")
+
+    files = {SOURCE: source_code.encode("utf-8")}
+    for filename, content in sorted((data or {}).items()):
+        files["data/" + filename] = content
+
+    content_hash = hashlib.sha256()
+    for filename, content in sorted(files.items()):
+        content_hash.update(filename.encode("utf-8") + b"\0" + hashlib.sha256(content).digest())
+
+    manifest = {
+        "name": function.__name__,
+        "entry": function.__name__,
+        "imports": sorted({line.split()[1].split(".")[0] for line in imports}),
+        "hash": content_hash.hexdigest(),
+        "options": ["pure"] if pure else []
+    }
+    files[MANIFEST] = json.dumps(manifest, indent=4, sort_keys=True).encode("utf-8")
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for filename, content in sorted(files.items()):
+            # a fixed timestamp, so that the archive only depends on its content
+            archive.writestr(zipfile.ZipInfo(filename, date_time=(1980, 1, 1, 0, 0, 0)), content)
+    return buf.getvalue()
+
+def is_archive(data):
+    return data[:4] == b"PK\x03\x04"
+
+def read_manifest(name, data):
+    if is_archive(data):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return json.loads(archive.read(MANIFEST))
+
+    return {"name": name, "entry": name, "imports": [], "options": sorted(parse_options(data.decode("utf-8")))}
+
+def unpack(data, path):
+    # unpacks into a temporary directory which is then renamed, so that a half unpacked function is never used
+    if os.path.isdir(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+    try:
+        if is_archive(data):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                archive.extractall(tmp)
+        else:
+            with open(os.path.join(tmp, SOURCE), "wb") as f:
+                f.write(data)
+        os.rename(tmp, path)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):  # not unpacked by another executor at the same time
+            raise
+
+def load_manifest(name, path):
+    # the manifest of an unpacked function
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    with open(os.path.join(path, SOURCE), "rb") as f:
+        return read_manifest(name, f.read())
+
+def load_function(path, entry, imports=()):
+    # imports the unpacked function, every version is imported as a separate module
+    for module in imports:
+        importlib.import_module(module)
+
+    module_name = "faas_" + os.path.basename(path)
+    module = sys.modules.get(module_name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(path, SOURCE))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+
+    if not hasattr(module, entry):
+        raise Exception(f"Function {entry} is not defined in {path}")
+    return getattr(module, entry)
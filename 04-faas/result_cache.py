@@ -0,0 +1,45 @@
+from collections import OrderedDict
+import threading
+import time
+
+# Cache of the results of pure functions, i.e. functions deployed with deploy(function, pure=True), keyed
+# by the checksum of the function's source code and the argument. Results expire after ttl seconds, and
+# the least recently used results are evicted when more than max_size results are cached.
+
+class ResultCache:
+    def __init__(self, max_size=100000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.results = OrderedDict()  # (checksum, arg) -> (result, expires)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, checksum, arg):
+        # returns (True, result) if the result is cached, otherwise (False, None)
+        key = (checksum, arg)
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None and cached[1] > time.time():
+                self.results.move_to_end(key)
+                self.stats["hits"] += 1
+                return True, cached[0]
+            if cached is not None:
+                del self.results[key]
+            self.stats["misses"] += 1
+            return False, None
+
+    def put(self, checksum, arg, result):
+        key = (checksum, arg)
+        with self.lock:
+            self.results[key] = (result, time.time() + self.ttl)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, size=len(self.results))
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"Result cache: {stats['size']} results, {stats['hits']} hits, {stats['misses']} misses")
@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import queue
+import threading
+from package import load_function
+
+# Pool of worker processes executing FaaS functions, so that a slow or crashing function does not block or
+# take down the executor.
+#
+# The workers are forked from a fork server, which has already imported the modules in preload. This keeps
+# imports out of the workers' start time, and forking is safe although the executor runs several threads.
+# Every worker imports the functions it is asked to call once, from the directory the function cache has
+# unpacked them into (see function_cache.py), so only the arguments and results are sent through the pipe.
+#
+# A batch of arguments is sent to a worker at once, and the worker sends back one result per argument as soon
+# as it is computed, ("ok", result) or ("error", message), so a failing argument does not fail the others.
+#
+# A worker is replaced after max_calls calls (to limit memory leaks in user code), when a call times out,
+# and when it crashes. Every argument of a batch counts as a call. The arguments after the one that timed out
+# or crashed are sent to another worker. New workers are started in a background thread, so that requests do
+# not have to wait for a worker to start.
+
+class WorkerCrashed(Exception):
+    pass
+
+def worker_main(conn):
+    functions = {}  # path of the unpacked function -> function
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:  # the executor has exited
+            break
+        if msg is None:
+            break
+
+        path, entry, imports, args = msg
+        try:
+            if path not in functions:
+                functions[path] = load_function(path, entry, imports)
+            function = functions[path]
+        except Exception as err:
+            for _ in args:
+                conn.send(("error", f"{type(err).__name__}: {err}"))
+            continue
+
+        for arg in args:
+            try:
+                conn.send(("ok", function(arg)))
+            except Exception as err:
+                conn.send(("error", f"{type(err).__name__}: {err}"))
+
+class Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.calls = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class WorkerPool:
+    def __init__(self, size=os.cpu_count(), max_calls=1000, preload=("package", "numpy")):
+        self.ctx = multiprocessing.get_context("forkserver")
+        self.ctx.set_forkserver_preload(list(preload))
+        self.size = size
+        self.max_calls = max_calls
+        self.idle = queue.Queue()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+        for _ in range(size):
+            self.idle.put(Worker(self.ctx))
+
+    def call(self, entry, arg, timeout=None):
+        # returns the result, raises an Exception if the call fails, times out or the worker crashes
+        status, result = self.call_many(entry, [arg], timeout=timeout)[0]
+        if status == "error":
+            raise Exception(result)
+        return result
+
+    def call_many(self, entry, args, timeout=None):
+        # calls the function of a function cache entry once per argument, and returns one ("ok", result) or
+        # ("error", message) pair per argument. A call is aborted if it takes more than timeout seconds
+        name = entry["manifest"]["name"]
+        results = []
+        while len(results) < len(args):
+            worker = self.idle.get()
+            sent = len(results)
+            try:
+                worker.conn.send((entry["path"], entry["manifest"]["entry"], entry["manifest"]["imports"], args[len(results):]))
+                while len(results) < len(args):
+                    if not worker.conn.poll(timeout):
+                        self.count("timeouts")
+                        self.replace(worker, kill=True)
+                        results.append(("error", f"TimeoutError: Function {name} did not finish within {timeout} seconds"))
+                        break
+                    status, result = worker.conn.recv()
+                    if status == "error":
+                        self.count("errors")
+                    results.append((status, result))
+                else:
+                    self.release(worker, len(results) - sent)
+            except (EOFError, OSError):
+                self.count("crashes")
+                self.replace(worker, kill=True)
+                results.append(("error", f"{WorkerCrashed.__name__}: Worker process crashed while executing function {name}"))
+        return results
+
+    def release(self, worker, calls=1):
+        # calls is the number of results the worker returned, a batch counts as one call per argument
+        worker.calls += calls
+        self.count("calls", calls)
+        if worker.calls >= self.max_calls:
+            self.count("recycled")
+            self.replace(worker)
+        else:
+            self.idle.put(worker)
+
+    def replace(self, worker, kill=False):
+        def restart():
+            if kill:
+                worker.kill()
+            else:
+                worker.stop()
+            with self.lock:
+                if not self.closed:
+                    self.idle.put(Worker(self.ctx))
+
+        threading.Thread(target=restart, daemon=True).start()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"Worker pool: {self.size} workers, {stats['calls']} calls, {stats['errors']} errors, {stats['timeouts']} timeouts, "
+              f"{stats['crashes']} crashes, {stats['recycled']} recycled")
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().stop()
+            except queue.Empty:
+                break
@@ -0,0 +1 @@
+../03-python/colonies_executor.py
\ No newline at end of file
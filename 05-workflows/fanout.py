@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# Adds many children to an assigned process, e.g. the map step of a dynamic map/reduce workflow:
+#
+#   fanout = FanOut(self.colonies, self.executor_prvkey)
+#   fanout.add_children(process, funcspecs, sink="sum_node")
+#
+# inserts one process per function spec between process and the node sink_node, which then gets all of
+# them as parents instead of process. Calling add_child in a loop costs a get_processgraph, a find_process
+# and an add_child per child. Here, the sink is looked up once per process graph and cached. If the client
+# supports adding all children in one request, like LocalColony in local_runner.py, that request is used.
+# Otherwise, the first child is inserted, and the rest are added with concurrent add_child requests.
+#
+# With thousands of children, the sink gets a huge input. Pass reducer, a function spec of an associative
+# function like sum, to reduce the children with a tree of reducer processes instead, see tree_reduce.py.
+
+class FanOut:
+    def __init__(self, colonies, prvkey, concurrency=16, max_cached=1024):
+        self.colonies = colonies
+        self.prvkey = prvkey
+        self.concurrency = concurrency
+        self.max_cached = max_cached
+        self.nodes = {}  # (processgraphid, nodename) -> processid
+
+    def find_node(self, processgraphid, nodename):
+        key = (processgraphid, nodename)
+        if key not in self.nodes:
+            processgraph = self.colonies.get_processgraph(processgraphid, self.prvkey)
+            process = self.colonies.find_process(nodename, processgraph.processids, self.prvkey)
+            if process is None:
+                raise Exception(f"Node {nodename} not found in process graph {processgraphid}")
+            if len(self.nodes) >= self.max_cached:
+                self.nodes.pop(next(iter(self.nodes)))
+            self.nodes[key] = process.processid
+        return self.nodes[key]
+
+    def add_children(self, process, funcspecs, sink=None, reducer=None, arity=16):
+        # adds the children to process, and makes them the parents of sink (a nodename) instead of process. If reducer
+        # is set, the children are reduced by a tree of reducer processes with at most arity parents each, see
+        # tree_reduce.py. Returns the process IDs of the children
+        sinkid = self.find_node(process.processgraphid, sink) if sink is not None else ""
+        if reducer is None or len(funcspecs) <= arity:
+            return self.attach(process, funcspecs, sinkid)
+        return self.attach_tree(process, funcspecs, sinkid, reducer, arity, sink or reducer.funcname)
+
+    def attach_tree(self, process, funcspecs, sinkid, reducer, arity, name, level=1):
+        # the reducers are added first, since a child must exist before its parents are added. A group of one
+        # needs no reducer, it is passed to the next level as it is. The reducers are named like in tree_reduce.py
+        groups = [funcspecs[i:i + arity] for i in range(0, len(funcspecs), arity)]
+        nodes = []
+        for i, group in enumerate(groups):
+            if len(group) == 1:
+                nodes.append(group[0])
+                continue
+            funcspec = reducer.model_copy(deep=True)
+            funcspec.nodename = f"{name}_reduce{level}_{i}"
+            nodes.append(funcspec)
+
+        if len(nodes) <= arity:
+            nodeids = self.attach(process, nodes, sinkid)
+        else:
+            nodeids = self.attach_tree(process, nodes, sinkid, reducer, arity, name, level + 1)
+
+        processids = []
+        for group, nodeid in zip(groups, nodeids):
+            if len(group) == 1:
+                processids.append(nodeid)
+            else:
+                processids.extend(self.attach(process, group, nodeid))
+        return processids
+
+    def attach(self, process, funcspecs, sinkid):
+        if len(funcspecs) == 0:
+            return []
+
+        if hasattr(self.colonies, "add_children"):
+            children = self.colonies.add_children(process.processgraphid, process.processid, sinkid, funcspecs, self.prvkey)
+            return [child.processid for child in children]
+
+        def add(funcspec, insert):
+            child = self.colonies.add_child(process.processgraphid, process.processid, sinkid, funcspec, funcspec.nodename,
+                                            insert, self.prvkey)
+            return child["processid"] if isinstance(child, dict) else child.processid
+
+        # the insert removes the edge between process and sink, the other children only add edges, so their
+        # order does not matter
+        processids = [add(funcspecs[0], sinkid != "")]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            processids.extend(pool.map(lambda funcspec: add(funcspec, False), funcspecs[1:]))
+        return processids
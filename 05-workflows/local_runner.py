@@ -0,0 +1,322 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pycolonies import Conditions, FuncSpec, Workflow
+from types import SimpleNamespace
+import argparse
+import importlib
+import json
+import os
+import threading
+import time
+import uuid
+import colonies_executor
+
+# Runs workflows in this process, without a Colonies server, using the same executors and function specs.
+#
+# LocalColony keeps the process graphs in memory and implements the part of the Colonies API used by the
+# executors and by submit_wf.py: submit_workflow, get_processgraph, get_process, find_process, add_child,
+# close, fail and wait, and add_children, which adds many children in one call (see fanout.py). LocalRunner
+# schedules every process whose parents have finished onto a thread pool, where it is executed by the
+# handler the executor registered with @function. The output of a process is passed to its children in
+# memory, like the Colonies server does: the input of a process is the outputs of its parents, concatenated
+# in the order the parents were added.
+#
+#   runner = LocalRunner(wf_executor.PythonExecutor)
+#   graph = runner.run(workflow)
+#   print(runner.colony.find_process("sum_node", graph.processids, "").output)
+
+WAITING, RUNNING, SUCCESSFUL, FAILED = 0, 1, 2, 3
+
+class LocalColony:
+    def __init__(self, colonyname="local"):
+        self.colonyname = colonyname
+        self.graphs = {}
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.on_ready = None  # called with every process that can be executed
+
+    def new_process(self, graph, spec, parents):
+        process = SimpleNamespace(processid=uuid.uuid4().hex, processgraphid=graph.processgraphid, spec=spec,
+                                  parents=parents, children=[], state=WAITING, input=[], output=None, errors=[], logs=[],
+                                  submissiontime=time.time(), starttime=None, endtime=None, assignedexecutorid="", thread="")
+        # the number of parents that have not finished yet, so that closing a parent does not have to check the others
+        process.waiting_for = sum(1 for parentid in parents if self.processes[parentid].state != SUCCESSFUL)
+        graph.unfinished += 1
+        for parentid in parents:
+            self.processes[parentid].children.append(process.processid)
+        self.processes[process.processid] = process
+        graph.processids.append(process.processid)
+        return process
+
+    def submit_workflow(self, workflow, prvkey):
+        nodenames = [spec.nodename for spec in workflow.functionspecs]
+        if len(set(nodenames)) != len(nodenames):
+            raise ValueError("Node names in a workflow must be unique")
+        for spec in workflow.functionspecs:
+            for dependency in spec.conditions.dependencies:
+                if dependency not in nodenames:
+                    raise ValueError(f"Node {spec.nodename} depends on unknown node {dependency}")
+
+        graph = SimpleNamespace(processgraphid=uuid.uuid4().hex, processids=[], rootprocessids=[], state=RUNNING,
+                                submissiontime=time.time(), endtime=None, unfinished=0, running=0, done=threading.Event())
+
+        # the processes are created in topological order, so that the parents of a process always exist
+        with self.lock:
+            self.graphs[graph.processgraphid] = graph
+            created = {}
+            remaining = list(workflow.functionspecs)
+            while remaining:
+                ready = [spec for spec in remaining if all(dependency in created for dependency in spec.conditions.dependencies)]
+                if len(ready) == 0:
+                    raise ValueError("Workflow contains a cycle: " + ", ".join(spec.nodename for spec in remaining))
+                for spec in ready:
+                    parents = [created[dependency].processid for dependency in spec.conditions.dependencies]
+                    created[spec.nodename] = self.new_process(graph, spec, parents)
+                    remaining.remove(spec)
+            graph.rootprocessids = [process.processid for process in created.values() if len(process.parents) == 0]
+
+        for processid in graph.rootprocessids:
+            self.on_ready(self.processes[processid])
+        return graph
+
+    def get_processgraph(self, processgraphid, prvkey):
+        return self.graphs[processgraphid]
+
+    def get_process(self, processid, prvkey):
+        return self.processes[processid]
+
+    def find_process(self, nodename, processids, prvkey):
+        for processid in processids:
+            process = self.processes[processid]
+            if process.spec.nodename == nodename:
+                return process
+        return None
+
+    def add_child(self, processgraphid, parentprocessid, childprocessid, funcspec, nodename, insert, prvkey):
+        # the same rules as the Colonies server: the parent must be running and the child must not have started. With
+        # insert, the new process replaces the parent as a parent of the child, otherwise it becomes an extra parent
+        funcspec = funcspec.model_copy(deep=True)
+        funcspec.nodename = nodename
+        with self.lock:
+            parent = self.processes[parentprocessid]
+            if parent.state != RUNNING:
+                raise Exception(f"Cannot add a child to process {parentprocessid}, it is not running")
+            process = self.new_process(self.graphs[processgraphid], funcspec, [parentprocessid])
+            if childprocessid:
+                child = self.processes[childprocessid]
+                if child.state != WAITING:
+                    raise Exception(f"Cannot add a parent to process {childprocessid}, it has already started")
+                if insert:
+                    child.parents.remove(parentprocessid)
+                    parent.children.remove(childprocessid)
+                    child.waiting_for -= 1
+                child.parents.append(process.processid)
+                child.waiting_for += 1
+                process.children.append(childprocessid)
+        return process
+
+    def add_children(self, processgraphid, parentprocessid, childprocessid, funcspecs, prvkey):
+        # adds all processes in one call, as if the first one was inserted and the others added with add_child,
+        # see fanout.py
+        with self.lock:
+            parent = self.processes[parentprocessid]
+            if parent.state != RUNNING:
+                raise Exception(f"Cannot add a child to process {parentprocessid}, it is not running")
+            graph = self.graphs[processgraphid]
+            processes = [self.new_process(graph, funcspec.model_copy(deep=True), [parentprocessid]) for funcspec in funcspecs]
+            if childprocessid:
+                child = self.processes[childprocessid]
+                if child.state != WAITING:
+                    raise Exception(f"Cannot add a parent to process {childprocessid}, it has already started")
+                if parentprocessid in child.parents:
+                    child.parents.remove(parentprocessid)
+                    parent.children.remove(childprocessid)
+                    child.waiting_for -= 1
+                for process in processes:
+                    child.parents.append(process.processid)
+                    process.children.append(childprocessid)
+                child.waiting_for += len(processes)
+        return processes
+
+    def start(self, process, executorname=""):
+        # the thread is only used to draw every worker thread on its own row in a trace, see profile_wf.py
+        with self.lock:
+            process.state = RUNNING
+            process.starttime = time.time()
+            process.assignedexecutorid = executorname
+            process.thread = threading.current_thread().name
+            self.graphs[process.processgraphid].running += 1
+
+    def close(self, processid, output, prvkey):
+        ready = []
+        with self.lock:
+            process = self.processes[processid]
+            process.output = output
+            process.state = SUCCESSFUL
+            process.endtime = time.time()
+            for childid in process.children:
+                child = self.processes[childid]
+                child.waiting_for -= 1
+                if child.waiting_for == 0:
+                    child.input = [value for parentid in child.parents for value in self.processes[parentid].output]
+                    ready.append(child)
+
+            graph = self.graphs[process.processgraphid]
+            graph.running -= 1
+            graph.unfinished -= 1
+            if graph.unfinished == 0 and graph.state != FAILED:
+                graph.state = SUCCESSFUL
+            self.update_graph(graph)
+
+        for child in ready:
+            self.on_ready(child)
+
+    def fail(self, processid, errors, prvkey):
+        # the children of a failed process are never executed, so the workflow fails
+        with self.lock:
+            process = self.processes[processid]
+            process.errors = errors
+            process.state = FAILED
+            process.endtime = time.time()
+            graph = self.graphs[process.processgraphid]
+            graph.running -= 1
+            graph.state = FAILED
+            self.update_graph(graph)
+
+    def update_graph(self, graph):
+        # a failed workflow is done when the processes that were already running have finished
+        if graph.state == SUCCESSFUL or (graph.state == FAILED and graph.running == 0):
+            graph.endtime = time.time()
+            graph.done.set()
+
+    def wait(self, process, timeout, prvkey):
+        graph = self.graphs[process.processgraphid]
+        deadline = time.time() + timeout
+        while process.state in (WAITING, RUNNING) and not graph.done.is_set() and time.time() < deadline:
+            graph.done.wait(min(0.1, max(0, deadline - time.time())))
+        return process
+
+    def add_log(self, processid, msg, prvkey):
+        self.processes[processid].logs.append(msg)
+
+    # executors register themselves when they are created, there is nothing to register locally
+    def add_executor(self, executor, prvkey):
+        return executor
+
+    def approve_executor(self, colonyname, executorname, prvkey):
+        pass
+
+    def add_function(self, colonyname, executorname, funcname, prvkey):
+        pass
+
+    def remove_executor(self, colonyname, executorname, prvkey):
+        pass
+
+class LocalRunner:
+    def __init__(self, *executor_classes, workers=os.cpu_count(), processes=0):
+        self.colony = LocalColony()
+        self.colony.on_ready = self.schedule
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        # the executors are created as usual, but talk to the local colony instead of the Colonies server
+        client = colonies_executor.colonies_client
+        colonies_executor.colonies_client = lambda: (self.colony, self.colony.colonyname, "", "", "")
+        try:
+            self.executors = {}
+            for executor_class in executor_classes:
+                executor = executor_class()
+                self.executors[executor.executortype] = executor
+        finally:
+            colonies_executor.colonies_client = client
+
+        # CPU heavy work passed to executor.offload() runs in a pool of worker processes
+        if processes > 0:
+            offload_pool = ProcessPoolExecutor(max_workers=processes, initializer=colonies_executor.init_offload_worker)
+            for executor in self.executors.values():
+                executor.offload_pool = offload_pool
+
+    def schedule(self, process):
+        self.pool.submit(self.execute, process)
+
+    def execute(self, process):
+        executor = self.executors.get(process.spec.conditions.executortype)
+        self.colony.start(process, executor.executorname if executor is not None else "")
+        if executor is None:
+            self.colony.fail(process.processid, [f"No local executor of type {process.spec.conditions.executortype}"], "")
+            return
+
+        executor.local.workerid = threading.current_thread().name
+        executor.local.stats = {}
+        try:
+            output = executor.execute(process)
+            self.colony.close(process.processid, output if output is not None else [], "")
+        except Exception as err:
+            print("Process", process.spec.nodename, "failed:", err)
+            self.colony.fail(process.processid, [str(err)], "")
+
+    def run(self, workflow, timeout=None):
+        # runs the workflow and returns its process graph, when all processes have finished or one has failed
+        graph = self.colony.submit_workflow(workflow, "")
+        if not graph.done.wait(timeout):
+            raise TimeoutError(f"Workflow {graph.processgraphid} did not finish within {timeout} seconds")
+        return graph
+
+    def leaves(self, graph):
+        # the processes without children, their outputs are the result of the workflow
+        return [self.colony.processes[processid] for processid in graph.processids
+                if len(self.colony.processes[processid].children) == 0]
+
+    def close(self):
+        self.pool.shutdown()
+
+def load_workflow(path, colonyname="local"):
+    # the same JSON format as "colonies workflow submit --spec"
+    with open(path) as f:
+        specs = json.load(f)
+    workflow = Workflow(colonyname=colonyname)
+    for spec in specs:
+        spec["conditions"] = Conditions(**dict(spec["conditions"], colonyname=colonyname))
+        workflow.functionspecs.append(FuncSpec(**spec))
+    return workflow
+
+def load_executor(name):
+    # module:class, e.g. wf_executor:PythonExecutor
+    module, _, classname = name.partition(":")
+    return getattr(importlib.import_module(module), classname or "PythonExecutor")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a workflow locally, without a Colonies server")
+    parser.add_argument("spec", help="workflow spec, e.g. sum_wf.json")
+    parser.add_argument("--executor", action="append", default=None,
+                        help="executor class (module:class) executing the processes, can be repeated, default wf_executor:PythonExecutor")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes executed at the same time")
+    parser.add_argument("--processes", type=int, default=0, help="size of the process pool used by executor.offload()")
+    parser.add_argument("--repeat", type=int, default=1, help="run the workflow this many times and print the mean time")
+    parser.add_argument("--trace", default=None, help="profile the last run and write a Chrome trace to this file, see profile_wf.py")
+    args = parser.parse_args()
+
+    # the executors print a line for every process, which would dominate the time of small workflows
+    colonies_executor.print = lambda *args: None
+    executor_classes = [load_executor(name) for name in (args.executor or ["wf_executor:PythonExecutor"])]
+    runner = LocalRunner(*executor_classes, workers=args.workers, processes=args.processes)
+    workflow = load_workflow(args.spec)
+
+    started = time.time()
+    for _ in range(args.repeat):
+        graph = runner.run(workflow)
+    elapsed = time.time() - started
+
+    for process in (runner.colony.processes[processid] for processid in graph.processids):
+        if process.state == FAILED:
+            print(process.spec.nodename, "failed:", process.errors)
+    for process in runner.leaves(graph):
+        if process.state == SUCCESSFUL:
+            print(process.spec.nodename, process.output)
+
+    print(f"{len(graph.processids)} processes, {elapsed / args.repeat * 1000:.2f}ms per workflow")
+    if args.trace is not None:
+        import profile_wf
+        nodes = profile_wf.local_nodes(runner.colony, graph)
+        report = profile_wf.analyze(nodes)
+        profile_wf.print_report(report)
+        profile_wf.write_trace(nodes, report, args.trace)
+    runner.close()
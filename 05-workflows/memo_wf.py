@@ -0,0 +1,192 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import time
+
+# Skips the nodes of a workflow whose inputs have not changed since they last succeeded:
+#
+#   python3 memo_wf.py plan ../13-earth-observation/workflow.json --output changed.json
+#   colonies workflow submit --spec changed.json
+#   python3 memo_wf.py record <processgraphid>       # when the workflow has finished
+#
+# Every node gets a key, a hash of its funcname, args, kwargs and env, the keys of its parents, and the
+# contents of the ColonyFS labels it reads: the checksums of the files in its sync dirs and snapshot labels,
+# or the ID of a snapshot. The files of a label written by an ancestor are not hashed, they are covered by
+# the key of that ancestor. A sync dir with "keeplocal": true on close is a label the node writes, like
+# /openeo/rutvik/images for fetch_openeo.
+#
+# plan writes the workflow without the nodes that have a cached result, and remembers the keys. record
+# stores a result for every node of the submitted workflow that succeeded: its output and the checksums of
+# the labels it wrote. A node is only skipped if those labels still contain the same files, so the files
+# are reused as they are. A skipped node whose output is needed by a node that runs is not skipped, since
+# the output of a process can only be passed to its children by the Colonies server.
+
+SUCCESSFUL = 2  # process state of the Colonies server, as in local_runner.py
+
+def label_digest(colonies, colonyname, prvkey, label):
+    # hash of the names and checksums of the latest revision of the files in the label
+    names = colonies.get_files(label, colonyname, prvkey) or []
+    files = []
+    for name in sorted(names):
+        revisions = colonies.get_file(colonyname, prvkey, label=label, filename=name, latest=True)
+        files.append([name, revisions[0]["checksum"] if revisions else ""])
+    return hashlib.sha256(json.dumps(files).encode()).hexdigest()
+
+def written_labels(spec):
+    fs = spec.get("fs") or {}
+    return [d["label"] for d in fs.get("dirs") or [] if d.get("onconflicts", {}).get("onclose", {}).get("keeplocal", False)]
+
+def read_labels(spec):
+    # sync dir and snapshot labels the node reads, and snapshot IDs, which never change
+    fs = spec.get("fs") or {}
+    written = written_labels(spec)
+    labels = [d["label"] for d in fs.get("dirs") or [] if d["label"] not in written]
+    snapshotids = []
+    for snapshot in fs.get("snapshots") or []:
+        if snapshot.get("snapshotid"):
+            snapshotids.append(snapshot["snapshotid"])
+        else:
+            labels.append(snapshot["label"])
+    return labels, snapshotids
+
+def sort_specs(specs):
+    # parents before children
+    by_name = specs_by_name(specs)
+    order, visiting, visited = [], set(), set()
+
+    def visit(nodename):
+        if nodename in visited:
+            return
+        if nodename in visiting:
+            raise ValueError(f"Workflow has a cycle through node {nodename}")
+        if nodename not in by_name:
+            raise ValueError(f"Unknown node {nodename}")
+        visiting.add(nodename)
+        for dependency in by_name[nodename]["conditions"].get("dependencies") or []:
+            visit(dependency)
+        visiting.discard(nodename)
+        visited.add(nodename)
+        order.append(by_name[nodename])
+
+    for spec in specs:
+        visit(spec["nodename"])
+    return order
+
+def specs_by_name(specs):
+    return {spec["nodename"]: spec for spec in specs}
+
+def node_keys(specs, digest):
+    # digest(label) returns the hash of the files in a label
+    by_name = specs_by_name(specs)
+    keys, ancestors = {}, {}
+    for spec in sort_specs(specs):
+        parents = spec["conditions"].get("dependencies") or []
+        ancestors[spec["nodename"]] = set(parents).union(*(ancestors[parent] for parent in parents))
+        produced = {label for ancestor in ancestors[spec["nodename"]] for label in written_labels(by_name[ancestor])}
+        labels, snapshotids = read_labels(spec)
+        key = {"funcname": spec.get("funcname", ""), "args": spec.get("args", []), "kwargs": spec.get("kwargs", {}),
+               "env": spec.get("env", {}), "parents": sorted(keys[parent] for parent in parents), "snapshots": sorted(snapshotids),
+               "labels": {label: digest(label) for label in labels if label not in produced}}
+        keys[spec["nodename"]] = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return keys
+
+def load_cache(path):
+    if not os.path.exists(path):
+        return {"entries": {}, "plan": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_cache(cache, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=4)
+    os.replace(tmp, path)
+
+def plan(specs, cache, digest):
+    # returns the specs of the nodes that have to run
+    keys = node_keys(specs, digest)
+    by_name = specs_by_name(specs)
+    cached = set()
+    for nodename, key in keys.items():
+        entry = cache["entries"].get(key)
+        if entry is not None and all(digest(label) == checksum for label, checksum in entry["labels"].items()):
+            cached.add(nodename)
+
+    # children before parents, so that a node that has to run for its output makes its parents run too
+    for spec in reversed(sort_specs(specs)):
+        if spec["nodename"] not in cached:
+            for parent in spec["conditions"].get("dependencies") or []:
+                if parent in cached and len(cache["entries"][keys[parent]]["output"]) > 0:
+                    cached.discard(parent)
+
+    run = []
+    for spec in specs:
+        if spec["nodename"] in cached:
+            continue
+        spec = json.loads(json.dumps(spec))
+        spec["conditions"]["dependencies"] = [d for d in spec["conditions"].get("dependencies") or [] if d not in cached]
+        run.append(spec)
+
+    cache["plan"] = {nodename: {"key": keys[nodename], "writes": written_labels(by_name[nodename])}
+                     for nodename in keys if nodename not in cached}
+    return run, cached
+
+def record(processes, cache, digest):
+    # stores the results of the successful processes of the planned nodes, returns their node names
+    recorded = []
+    for process in processes:
+        planned = cache["plan"].get(process.spec.nodename)
+        if planned is None or process.state != SUCCESSFUL:
+            continue
+        cache["entries"][planned["key"]] = {"nodename": process.spec.nodename, "processid": process.processid,
+                                            "output": process.output or [], "time": time.time(),
+                                            "labels": {label: digest(label) for label in planned["writes"]}}
+        recorded.append(process.spec.nodename)
+    return recorded
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Skip the workflow nodes whose inputs have not changed since they last succeeded")
+    parser.add_argument("--cache", default=".memo.json", help="file the results and the last plan are stored in")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="write the workflow without the nodes that have a cached result")
+    plan_parser.add_argument("spec", help="workflow spec, e.g. ../13-earth-observation/workflow.json")
+    plan_parser.add_argument("--output", default="changed.json", help="file to write the workflow of the nodes to run to")
+    record_parser = subparsers.add_parser("record", help="store the results of a workflow submitted after plan")
+    record_parser.add_argument("processgraphid", help="ID of the process graph, printed when the workflow is submitted")
+    args = parser.parse_args()
+
+    from pycolonies import colonies_client
+    colonies, colonyname, colony_prvkey, executor_name, prvkey = colonies_client()
+
+    digests = {}
+    def digest(label):
+        # a label is looked up once, even if many nodes read it
+        if label not in digests:
+            digests[label] = label_digest(colonies, colonyname, prvkey, label)
+        return digests[label]
+
+    cache = load_cache(args.cache)
+    if args.command == "plan":
+        with open(args.spec) as f:
+            specs = json.load(f)
+        run, cached = plan(specs, cache, digest)
+        save_cache(cache, args.cache)
+        for spec in specs:
+            print(f"{spec['nodename']:<24} {'cached' if spec['nodename'] in cached else 'run'}")
+        if len(run) == 0:
+            print("Nothing to run, all nodes are cached")
+            if os.path.exists(args.output):
+                os.remove(args.output)
+        else:
+            with open(args.output, "w") as f:
+                json.dump(run, f, indent=4)
+            print(f"{len(run)} of {len(specs)} nodes written to {args.output}")
+    else:
+        processgraph = colonies.get_processgraph(args.processgraphid, prvkey)
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            processes = list(pool.map(lambda processid: colonies.get_process(processid, prvkey), processgraph.processids))
+        recorded = record(processes, cache, digest)
+        save_cache(cache, args.cache)
+        print(f"Recorded {len(recorded)} nodes: {', '.join(recorded)}")
@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+
+# Shows where the time of a workflow goes:
+#
+#   python3 profile_wf.py <processgraphid> --trace trace.json
+#
+# Every process of the process graph is fetched from the Colonies server, and for every node the time it
+# waited for an executor after its parents had finished (queue) and the time it ran (run) are computed.
+# The critical path is the chain of processes that determined when the workflow finished: starting from the
+# process that finished last, it follows the parent that finished last. Speeding up any process off the
+# critical path does not make the workflow finish earlier.
+#
+# The trace file can be opened in chrome://tracing or https://ui.perfetto.dev, with one row per executor.
+
+def to_seconds(t):
+    # the Colonies server reports times that have not happened yet as year 1
+    if t is None:
+        return None
+    if isinstance(t, (int, float)):
+        return float(t)
+    return t.timestamp() if t.year > 1970 else None
+
+def short(executor):
+    # executor IDs are 64 hex digits, the first 12 are enough to tell them apart
+    return executor if len(executor) <= 24 else executor[:12]
+
+def node(processid, nodename, funcname, parents, executor, submitted, started, ended, thread=None):
+    # thread is the worker thread of the executor, if known, only used for the rows of the trace
+    return {"processid": processid, "nodename": nodename, "funcname": funcname, "parents": list(parents), "executor": executor,
+            "thread": thread, "submitted": to_seconds(submitted), "started": to_seconds(started), "ended": to_seconds(ended)}
+
+def fetch_nodes(colonies, processgraphid, prvkey, concurrency=16):
+    processgraph = colonies.get_processgraph(processgraphid, prvkey)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        processes = list(pool.map(lambda processid: colonies.get_process(processid, prvkey), processgraph.processids))
+    return [node(p.processid, p.spec.nodename, p.spec.funcname, p.parents, p.assignedexecutorid,
+                 p.submissiontime, p.starttime, p.endtime) for p in processes]
+
+def local_nodes(colony, graph):
+    # the processes of a workflow run by local_runner.py
+    processes = [colony.processes[processid] for processid in graph.processids]
+    return [node(p.processid, p.spec.nodename, p.spec.funcname, p.parents, p.assignedexecutorid, p.submissiontime,
+                 p.starttime, p.endtime, thread=p.thread) for p in processes]
+
+def analyze(nodes):
+    # adds the ready, queue and run times to the finished nodes, and returns the report
+    by_id = {n["processid"]: n for n in nodes}
+    finished = [n for n in nodes if n["ended"] is not None and n["started"] is not None]
+    finished_ids = {n["processid"] for n in finished}
+    if len(finished) == 0:
+        raise ValueError("No process in the workflow has finished")
+
+    for n in finished:
+        # a process is ready when it has been submitted and all its parents have finished
+        parent_ends = [by_id[p]["ended"] for p in n["parents"] if p in by_id and by_id[p]["ended"] is not None]
+        n["ready"] = max([n["submitted"]] + parent_ends)
+        n["queue"] = max(0.0, n["started"] - n["ready"])
+        n["run"] = n["ended"] - n["started"]
+
+    path = [max(finished, key=lambda n: n["ended"])]
+    while True:
+        parents = [by_id[p] for p in path[-1]["parents"] if p in finished_ids]
+        if len(parents) == 0:
+            break
+        path.append(max(parents, key=lambda n: n["ended"]))
+    path.reverse()
+
+    start = min(n["submitted"] for n in finished)
+    end = max(n["ended"] for n in finished)
+    executors = {}
+    for n in finished:
+        executors[n["executor"]] = executors.get(n["executor"], 0.0) + n["run"]
+
+    return {
+        "processes": len(nodes),
+        "finished": len(finished),
+        "makespan": end - start,
+        "critical_path": [{"processid": n["processid"], "nodename": n["nodename"], "funcname": n["funcname"], "queue": n["queue"],
+                           "run": n["run"]} for n in path],
+        "critical_queue": sum(n["queue"] for n in path),
+        "critical_run": sum(n["run"] for n in path),
+        "nodes": [{"nodename": n["nodename"], "funcname": n["funcname"], "executor": n["executor"], "queue": n["queue"], "run": n["run"]}
+                  for n in sorted(finished, key=lambda n: n["started"])],
+        "executors": {executor: {"busy": busy, "utilization": busy / (end - start) if end > start else 0.0}
+                      for executor, busy in executors.items()}
+    }
+
+def chrome_trace(nodes, report):
+    # complete events (ph X) in microseconds, one row per executor (or worker thread of an executor, if known),
+    # queue time as separate events
+    critical = {n["processid"] for n in report["critical_path"]}
+    finished = [n for n in nodes if "run" in n]
+    start = min(n["submitted"] for n in finished)
+    rows = sorted({(n["executor"], n["thread"] or "") for n in finished})
+    tids = {row: i + 1 for i, row in enumerate(rows)}
+    events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+               "args": {"name": f"executor {short(executor)}" + (f" {thread}" if thread else "")}}
+              for (executor, thread), tid in tids.items()]
+    events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "queue"}})
+    for n in finished:
+        args = {"processid": n["processid"], "queue_ms": n["queue"] * 1000, "critical": n["processid"] in critical}
+        events.append({"name": n["nodename"], "cat": "critical" if n["processid"] in critical else n["funcname"], "ph": "X",
+                       "ts": (n["started"] - start) * 1e6, "dur": n["run"] * 1e6, "pid": 1,
+                       "tid": tids[(n["executor"], n["thread"] or "")], "args": args})
+        if n["queue"] > 0:
+            events.append({"name": n["nodename"] + " (queued)", "cat": "queue", "ph": "X", "ts": (n["ready"] - start) * 1e6,
+                           "dur": n["queue"] * 1e6, "pid": 1, "tid": 0, "args": args})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def print_report(report):
+    print(f"{report['finished']} of {report['processes']} processes finished, makespan {report['makespan'] * 1000:.1f}ms")
+    print(f"Critical path: {len(report['critical_path'])} processes, queue {report['critical_queue'] * 1000:.1f}ms, "
+          f"run {report['critical_run'] * 1000:.1f}ms")
+    for n in report["critical_path"]:
+        print(f"  {n['nodename']:<24} {n['funcname']:<16} queue {n['queue'] * 1000:9.1f}ms  run {n['run'] * 1000:9.1f}ms")
+    for executor, stats in report["executors"].items():
+        print(f"Executor {short(executor)}: busy {stats['busy'] * 1000:.1f}ms, utilization {stats['utilization'] * 100:.0f}%")
+
+def write_trace(nodes, report, path):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(nodes, report), f)
+    print("Trace written to", path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the critical path of a workflow and export its timeline")
+    parser.add_argument("processgraphid", help="ID of the process graph, printed when the workflow is submitted")
+    parser.add_argument("--trace", default=None, help="file to write a Chrome trace (Perfetto) timeline to")
+    parser.add_argument("--json", default=None, help="file to write the report to")
+    args = parser.parse_args()
+
+    from pycolonies import colonies_client
+    colonies, colonyname, colony_prvkey, executor_name, prvkey = colonies_client()
+
+    nodes = fetch_nodes(colonies, args.processgraphid, prvkey)
+    report = analyze(nodes)
+    print_report(report)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.trace is not None:
+        write_trace(nodes, report, args.trace)
@@ -0,0 +1,73 @@
+from pycolonies import Workflow
+import argparse
+import json
+
+# Turns a node with many parents, e.g. a sum over thousands of processes, into a tree of partial reducers:
+#
+#   p0 ... p7   p8 ... p15   ...                    p0 ... p7   p8 ... p15   ...
+#    \  |  /     \  |  /           becomes           \  |  /     \  |  /
+#    sum_node (1000 parents)                      sum_node_reduce1_0  sum_node_reduce1_1  ...
+#                                                            \          |          /
+#                                                                  sum_node
+#
+# Every reducer is a copy of the node, with at most arity parents, so no process gets a huge input and the
+# reducers run in parallel on different executors. This is only correct if the function is associative,
+# i.e. reducing partial results gives the same result as reducing everything at once, and its output can be
+# used as its input, like sum in wf_executor.py. The parents are grouped in order, so the function does not
+# have to be commutative.
+
+def tree_reduce(workflow, nodename, arity=8):
+    # returns a copy of the workflow where nodename has at most arity parents
+    if arity < 2:
+        raise ValueError("The arity must be at least 2")
+    specs = [spec.model_copy(deep=True) for spec in workflow.functionspecs]
+    node = next((spec for spec in specs if spec.nodename == nodename), None)
+    if node is None:
+        raise ValueError(f"Node {nodename} not found in workflow")
+
+    reducers = []
+    parents = node.conditions.dependencies
+    level = 0
+    while len(parents) > arity:
+        level += 1
+        groups = [parents[i:i + arity] for i in range(0, len(parents), arity)]
+        parents = []
+        for i, group in enumerate(groups):
+            if len(group) == 1:
+                # a reducer of one parent would only copy its output
+                parents.append(group[0])
+                continue
+            reducer = node.model_copy(deep=True)
+            reducer.nodename = f"{nodename}_reduce{level}_{i}"
+            reducer.conditions.dependencies = group
+            reducers.append(reducer)
+            parents.append(reducer.nodename)
+    node.conditions.dependencies = parents
+
+    index = specs.index(node)
+    return Workflow(colonyname=workflow.colonyname, functionspecs=specs[:index] + reducers + specs[index:])
+
+if __name__ == '__main__':
+    from local_runner import load_workflow
+
+    parser = argparse.ArgumentParser(description="Rewrite a workflow spec so that a node is reduced as a tree")
+    parser.add_argument("spec", help="workflow spec, e.g. sum_wf.json")
+    parser.add_argument("nodename", help="the node with many parents, e.g. sum_node")
+    parser.add_argument("--arity", type=int, default=8, help="maximum number of parents of every node in the tree")
+    parser.add_argument("--output", default=None, help="file to write the new spec to, by default it is printed")
+    args = parser.parse_args()
+
+    workflow = tree_reduce(load_workflow(args.spec, colonyname=""), args.nodename, args.arity)
+    specs = []
+    for spec in workflow.functionspecs:
+        # the colony name is set when the workflow is submitted, like in the original spec
+        spec = spec.model_dump(exclude_defaults=True)
+        spec["conditions"].pop("colonyname", None)
+        specs.append(spec)
+
+    output = json.dumps(specs, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
@@ -1,10 +1,31 @@
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
 from typing import List, Dict, Optional
+from datetime import datetime, timezone
+import numpy as np
+import os
+import threading
+from storage import open_storage
+from reference_profile import ReferenceProfile
+from sliding_detector import SlidingWindowKLDetector
+from waveform import generate_single_sample
+import wire
 
 app = FastAPI()
 
-database: Dict[str, Dict] = {}
+# set TSDB_ENGINE=memory to keep the time series in memory only, like in the first version of the backend
+database = open_storage(os.getenv("TSDB_ENGINE", "sqlite"), os.getenv("TSDB_PATH", "timeseries.db"))
+
+# used to check appended samples for anomalies
+if os.getenv("ANOMALY_REFERENCE_PROFILE") is not None:
+    reference_profile = ReferenceProfile.load(os.getenv("ANOMALY_REFERENCE_PROFILE"))
+else:
+    reference_profile = ReferenceProfile.from_wave(generate_single_sample()["normal_wave"].values)
+
+# sliding window detectors of the streamed time series, and the offset of their first sample
+detectors: Dict[str, tuple] = {}
+detectors_lock = threading.Lock()
 
 class TimeSeriesData(BaseModel):
     time: str
@@ -16,70 +37,233 @@ class TimeSeriesInput(BaseModel):
     data: List[TimeSeriesData]
     anomaly: Optional[bool] = False
 
+class TimeSeriesAppendInput(BaseModel):
+    data: List[TimeSeriesData]
+
+class BulkFetchInput(BaseModel):
+    ts_ids: List[str]
+
+class BulkAnomalyInput(BaseModel):
+    process_id: str
+    anomalies: Dict[str, bool]
+
+def parse_time(t):
+    try:
+        return float(t)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(t)
+    except ValueError:
+        raise ValueError(f"Invalid time '{t}', must be a number or an ISO 8601 timestamp")
+    # timestamps without a time zone are UTC, so the order does not depend on where the backend runs
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def parse_times(data):
+    # the time strings are kept as they were sent, and converted to float64 seconds (ISO 8601 strings to Unix
+    # time) to order the samples. Raises HTTPException 422 if a time cannot be converted
+    labels = [point.time for point in data]
+    try:
+        return np.array([parse_time(t) for t in labels], dtype=np.float64), labels
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
+def accepts_binary(request):
+    return wire.CONTENT_TYPE in request.headers.get("accept", "")
+
+# The time series can be sent either as JSON (TimeSeriesInput) or using the binary encoding in wire.py
+# (Content-Type: application/x-timeseries), in which case the anomaly status is given as a query parameter.
 @app.put("/timeseries/{ts_id}")
-def create_or_update_timeseries(ts_id: str, ts_input: TimeSeriesInput):
+async def create_or_update_timeseries(ts_id: str, request: Request, anomaly: bool = False):
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith(wire.CONTENT_TYPE):
+        try:
+            times, values, _ = wire.decode(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        labels = None
+        if times is None:
+            times = np.arange(len(values), dtype=np.float64)
+    else:
+        try:
+            ts_input = TimeSeriesInput.model_validate_json(body)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+        times, labels = parse_times(ts_input.data)
+        values = np.array([point.value for point in ts_input.data], dtype=np.float64)
+        anomaly = ts_input.anomaly
+
     try:
-        database[ts_id] = {
-            "data": ts_input.data,  # Store the time series as-is
-            "anomaly": ts_input.anomaly
-        }
+        with detectors_lock:
+            detectors.pop(ts_id, None)
+        await run_in_threadpool(database.put, ts_id, times, values, anomaly, None, labels)
         return {"message": f"Time series data for time series ID '{ts_id}' stored or updated successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def append_samples(ts_id, times, values, window, step, labels=None):
+    with detectors_lock:
+        meta = database.get_meta(ts_id)
+        offset = meta["length"] if meta is not None else 0
+        if times is None:
+            times = np.arange(offset, offset + len(values), dtype=np.float64)
+        length = database.append(ts_id, times, values, labels)
+
+        events = []
+        kl_divergence = None
+        if window > 0:
+            detector, start = detectors.get(ts_id, (None, offset))
+            if detector is None or detector.window != window or detector.step != step:
+                detector, start = SlidingWindowKLDetector(reference_profile, window=window, step=step), offset
+                detectors[ts_id] = (detector, start)
+
+            events = [{"offset": start + event.offset, "kl_divergence": event.kl_divergence, "anomaly": event.anomaly}
+                      for event in detector.push(values)]
+            kl_divergence = detector.kl_divergence
+            if any(event["anomaly"] for event in events):
+                database.set_anomaly(ts_id, True, "backend")
+
+    return {"ts_id": ts_id, "length": length, "kl_divergence": kl_divergence, "events": events}
+
+# Appends samples to a time series, the time series is created if it does not exist. If window is set, the
+# appended samples are checked for anomalies using a sliding window of that many samples, which is moved step
+# samples at a time (step equal to window checks one window at a time). The response contains the events
+# where an anomaly starts or ends, and the time series is marked as anomalous if an anomaly is found.
+@app.post("/timeseries/{ts_id}/append", response_model=Dict)
+async def append_timeseries(ts_id: str, request: Request, window: int = Query(0, ge=0), step: int = Query(1, ge=1)):
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith(wire.CONTENT_TYPE):
+        try:
+            times, values, _ = wire.decode(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        labels = None
+    else:
+        try:
+            append_input = TimeSeriesAppendInput.model_validate_json(body)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+        times, labels = parse_times(append_input.data)
+        values = np.array([point.value for point in append_input.data], dtype=np.float64)
+
+    try:
+        return await run_in_threadpool(append_samples, ts_id, times, values, window, step, labels)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Same as the append endpoint, but every binary message received on the WebSocket is appended to the time
+# series, and the result of the append is sent back as a JSON message.
+@app.websocket("/timeseries/{ts_id}/stream")
+async def stream_timeseries(websocket: WebSocket, ts_id: str, window: int = 0, step: int = 1):
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_bytes()
+            try:
+                times, values, _ = wire.decode(message)
+                result = await run_in_threadpool(append_samples, ts_id, times, values, window, step)
+            except Exception as e:
+                result = {"ts_id": ts_id, "error": str(e)}
+            await websocket.send_json(result)
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/timeseries/{ts_id}", response_model=Dict)
-def get_timeseries(ts_id: str):
+def get_timeseries(ts_id: str, request: Request):
     try:
-        if ts_id not in database:
+        meta = database.get_meta(ts_id)
+        if meta is None:
             raise HTTPException(status_code=404, detail=f"Time series data for time series ID '{ts_id}' not found.")
-        
-        record = database[ts_id]
-        
+
+        times, values = database.get(ts_id)
+
+        if accepts_binary(request):
+            return Response(content=wire.encode(values, times), media_type=wire.CONTENT_TYPE,
+                            headers={"X-Anomaly": str(meta["anomaly"]).lower()})
+
         return {
             "ts_id": ts_id,
-            "data": record["data"],
-            "anomaly": record["anomaly"]
+            "data": [{"time": t, "value": v} for t, v in zip(database.get_labels(ts_id), values.tolist())],
+            "anomaly": meta["anomaly"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/timeseries/", response_model=Dict)
 def list_timeseries(anomalies: bool = Query(False, description="Set to True to list only time series with anomalies")):
     try:
-        if anomalies:
-            filtered_timeseries = [{"ts_id": ts_id, "process_id": record.get("process_id", None), "anomaly": record["anomaly"]}
-                                   for ts_id, record in database.items() if record["anomaly"]]
-        else:
-            filtered_timeseries = [{"ts_id": ts_id, "process_id": record.get("process_id", None), "anomaly": record["anomaly"]}
-                                   for ts_id, record in database.items() if not record["anomaly"]]
-
-        return {"timeseries": filtered_timeseries}
+        return {"timeseries": database.list(anomalies)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/timeseries/bulk", response_model=Dict)
+def get_timeseries_bulk(bulk_input: BulkFetchInput, request: Request):
+    try:
+        if accepts_binary(request):
+            # missing time series are left out, the times are not included to keep the response small
+            found = [(ts_id, database.get(ts_id)) for ts_id in bulk_input.ts_ids]
+            return Response(content=wire.encode_many((ts_id, None, record[1]) for ts_id, record in found if record is not None),
+                            media_type=wire.CONTENT_TYPE)
+
+        timeseries = []
+        missing = []
+        for ts_id in bulk_input.ts_ids:
+            meta = database.get_meta(ts_id)
+            if meta is None:
+                missing.append(ts_id)
+                continue
+
+            _, values = database.get(ts_id)
+            timeseries.append({
+                "ts_id": ts_id,
+                "values": values.tolist(),
+                "anomaly": meta["anomaly"]
+            })
+
+        return {"timeseries": timeseries, "missing": missing}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.patch("/timeseries/anomaly", response_model=Dict)
+def update_anomaly_status_bulk(bulk_input: BulkAnomalyInput):
+    try:
+        if not database.set_anomalies(bulk_input.anomalies, bulk_input.process_id):
+            missing = [ts_id for ts_id in bulk_input.anomalies if ts_id not in database]
+            raise HTTPException(status_code=404, detail=f"Time series data for time series IDs {missing} not found.")
+
+        return {"message": f"Anomaly status for {len(bulk_input.anomalies)} time series updated and process_id set to {bulk_input.process_id}."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.patch("/timeseries/{ts_id}/anomaly", response_model=Dict)
 def update_anomaly_status(ts_id: str, anomaly: bool, process_id: str):
     try:
-        if ts_id not in database:
+        if not database.set_anomaly(ts_id, anomaly, process_id):
             raise HTTPException(status_code=404, detail=f"Time series data for time series ID '{ts_id}' not found.")
 
-        database[ts_id]["anomaly"] = anomaly
-        database[ts_id]["process_id"] = process_id
-
         return {"message": f"Anomaly status for time series ID '{ts_id}' updated to {anomaly} and process_id set to {process_id}."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/timeseries/{ts_id}", response_model=Dict)
 def delete_timeseries(ts_id: str):
     try:
-        if ts_id not in database:
+        with detectors_lock:
+            detectors.pop(ts_id, None)
+        if not database.delete(ts_id):
             raise HTTPException(status_code=404, detail=f"Time series data for time series ID '{ts_id}' not found.")
-        
-        del database[ts_id]
-        
+
         return {"message": f"Time series data for time series ID '{ts_id}' deleted successfully."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,116 +1,173 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import numpy as np
 import pandas as pd
-from scipy.stats import entropy
-import matplotlib.pyplot as plt
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-
-# Function to find the zero crossings of a signal
-def find_zero_crossings(signal):
-    zero_crossings = np.where(np.diff(np.sign(signal)))[0]
-    return zero_crossings
-
-# Function to trim the signal to start and end at zero crossings
-def trim_to_zero_crossings(signal):
-    zero_crossings = find_zero_crossings(signal)
-    if len(zero_crossings) >= 2:
-        return signal[zero_crossings[0]:zero_crossings[-1]]
+from numpy.lib.stride_tricks import sliding_window_view
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, precision_recall_curve
+from reference_profile import ReferenceProfile
+
+# The dataset is read in chunks, and every chunk is split into windows using a strided view, so the windows
+# are not copied when they are created. The KL divergences are computed using the reference profile, with the
+# same binning as the anomaly detector, see reference_profile.py. Computing them copies the windows, which are
+# much larger than the chunk when they overlap (window / step times), so at most WINDOW_BATCH_SAMPLES samples
+# of windows are processed at a time.
+
+COLUMNS = ["normal_wave", "anomaly_wave", "is_anomaly"]
+WINDOW_BATCH_SAMPLES = 4_000_000
+
+def read_chunks(path, chunk_size):
+    # yields dicts with the COLUMNS as NumPy arrays, the format is given by the file extension
+    extension = os.path.splitext(path)[1]
+    if extension == ".npy":
+        dataset = np.load(path, mmap_mode="r")
+        for start in range(0, len(dataset), chunk_size):
+            chunk = dataset[start:start + chunk_size]
+            yield {column: np.asarray(chunk[column]) for column in COLUMNS}
+    elif extension == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading .parquet files requires pyarrow, install it with: pip3 install pyarrow")
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=COLUMNS):
+            yield {column: batch.column(column).to_numpy() for column in COLUMNS}
+    elif extension == ".csv":
+        for chunk in pd.read_csv(path, usecols=COLUMNS, chunksize=chunk_size):
+            yield {column: chunk[column].values for column in COLUMNS}
     else:
-        return signal
-
-# Load the dataset
-df = pd.read_csv('dataset.csv')
-
-# Define the chunk size (1 second = 1000 samples)
-sampling_rate = 1000
-chunk_size = sampling_rate  # 1 second chunk size
-
-# Prepare 1-second chunks of the normal_wave and trim to zero crossings
-window_size = chunk_size
-step_size = 1000  # 1-second overlap
-normal_chunks = []
-for i in range(0, len(df) - window_size, step_size):
-    chunk = df['normal_wave'].iloc[i:i + window_size].values
-    trimmed_chunk = trim_to_zero_crossings(chunk)
-    normal_chunks.append(trimmed_chunk)
-
-# Prepare 1-second chunks of the anomaly_wave and trim to zero crossings
-anomaly_chunks = []
-for i in range(0, len(df) - window_size, step_size):
-    chunk = df['anomaly_wave'].iloc[i:i + window_size].values
-    trimmed_chunk = trim_to_zero_crossings(chunk)
-    anomaly_chunks.append(trimmed_chunk)
-
-# Function to compute the probability distribution from a histogram
-def compute_histogram(data, bins=50):
-    hist, bin_edges = np.histogram(data, bins=bins, density=True)
-    hist = hist + 1e-10  # Avoid division by zero
-    return hist, bin_edges
-
-# Function to compute KL divergence
-def compute_kl_divergence(p, q):
-    return entropy(p, q)
-
-# Estimate the distribution of the normal wave (using the first chunk as reference)
-normal_wave = normal_chunks[0]  # Taking the first chunk as an example
-p_hist, p_bins = compute_histogram(normal_wave)
-
-# Compute the KL divergence for each chunk of the anomaly wave
-kl_divergences = []
-for anomaly_wave in anomaly_chunks:
-    q_hist, q_bins = compute_histogram(anomaly_wave)
-    kl_div = compute_kl_divergence(p_hist, q_hist)
-    kl_divergences.append(kl_div)
-
-# Set a threshold for anomaly detection (e.g., mean + 2 standard deviations)
-kl_threshold = np.mean(kl_divergences) + 0.1 * np.std(kl_divergences)
-print(f"Anomaly detection threshold (KL Divergence): {kl_threshold}")
-
-# Detect anomalies based on KL divergence
-anomaly_predictions = np.array(kl_divergences) > kl_threshold
-
-# Aggregate ground truth for each chunk (taking max of 'is_anomaly' in each chunk)
-ground_truth_chunks = []
-for i in range(0, len(df) - window_size, step_size):
-    chunk_ground_truth = df['is_anomaly'].iloc[i:i + window_size].values
-    ground_truth_chunks.append(np.max(chunk_ground_truth))  # Take max value in chunk (1 if any anomaly)
-
-# Convert ground truth to numpy array for consistency
-ground_truth_chunks = np.array(ground_truth_chunks)
-
-# Calculate accuracy, precision, recall, and F1-score
-accuracy = accuracy_score(ground_truth_chunks, anomaly_predictions)
-precision = precision_score(ground_truth_chunks, anomaly_predictions)
-recall = recall_score(ground_truth_chunks, anomaly_predictions)
-f1 = f1_score(ground_truth_chunks, anomaly_predictions)
-
-# Print the evaluation metrics
-print(f"Accuracy: {accuracy:.4f}")
-print(f"Precision: {precision:.4f}")
-print(f"Recall: {recall:.4f}")
-print(f"F1-Score: {f1:.4f}")
-
-# Plot the KL divergence and the ground truth 'is_anomaly' labels
-plt.figure(figsize=(12, 6))
-
-# Plot KL divergence
-plt.subplot(2, 1, 1)
-plt.plot(kl_divergences, label='KL Divergence', color='b')
-plt.axhline(y=kl_threshold, color='r', linestyle='--', label='Threshold')
-plt.title('KL Divergence Over Chunks')
-plt.xlabel('Chunk Index')
-plt.ylabel('KL Divergence')
-plt.legend()
-
-# Plot the ground truth anomalies
-plt.subplot(2, 1, 2)
-plt.plot(ground_truth_chunks, label='True Anomalies', color='g')
-plt.title('Ground Truth Anomalies (is_anomaly)')
-plt.xlabel('Chunk Index')
-plt.ylabel('Anomaly (0 or 1)')
-plt.legend()
-
-plt.tight_layout()
-plt.show()
-
-# Display the number of detected anomalies
-print(f"Detected {np.sum(anomaly_predictions)} anomalies out of {len(kl_divergences)} chunks.")
+        raise ValueError(f"Unsupported dataset format: {extension}, must be .csv, .npy or .parquet")
+
+def read_window_chunks(path, window_size, step_size, chunk_size):
+    # yields chunks holding a whole number of windows, the samples of windows that do not fit in a chunk
+    # are carried over to the next chunk
+    leftover = None
+    for chunk in read_chunks(path, chunk_size):
+        if leftover is not None:
+            chunk = {column: np.concatenate([leftover[column], chunk[column]]) for column in COLUMNS}
+        length = len(chunk["normal_wave"])
+        if length < window_size:
+            leftover = chunk
+            continue
+
+        num_windows = (length - window_size) // step_size + 1
+        end = (num_windows - 1) * step_size + window_size
+        yield {column: chunk[column][:end] for column in COLUMNS}
+        leftover = {column: chunk[column][num_windows * step_size:] for column in COLUMNS}
+
+def zero_crossing_mask(windows):
+    # True for the samples between the first and the last zero crossing of every window, windows with
+    # less than two zero crossings are used as they are
+    signs = np.sign(windows)
+    crossings = signs[:, 1:] != signs[:, :-1]
+    first = np.argmax(crossings, axis=1)
+    last = crossings.shape[1] - 1 - np.argmax(crossings[:, ::-1], axis=1)
+    trim = np.sum(crossings, axis=1) >= 2
+    positions = np.arange(windows.shape[1])
+    return ~trim[:, None] | ((positions >= first[:, None]) & (positions < last[:, None]))
+
+def evaluate_chunk(reference_profile, window_size, step_size, chunk):
+    # the views are created here, so that only the chunk is sent to the worker processes
+    anomaly_wave = sliding_window_view(chunk["anomaly_wave"], window_size)[::step_size]
+    is_anomaly = sliding_window_view(chunk["is_anomaly"], window_size)[::step_size]
+
+    batch_size = max(1, WINDOW_BATCH_SAMPLES // window_size)
+    kl_divergences, ground_truth = [], []
+    for start in range(0, len(anomaly_wave), batch_size):
+        windows = anomaly_wave[start:start + batch_size]
+        kl_divergences.append(reference_profile.kl_divergences(windows, zero_crossing_mask(windows)))
+        # a window is anomalous if any of its samples is
+        ground_truth.append(np.max(is_anomaly[start:start + batch_size], axis=1))
+    return np.concatenate(kl_divergences), np.concatenate(ground_truth)
+
+def calibrate(path, reference_profile=None, window_size=1000, step_size=1000, chunk_size=1_000_000, workers=1):
+    chunks = read_window_chunks(path, window_size, step_size, chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError(f"The dataset {path} is shorter than one window ({window_size} samples)")
+
+    if reference_profile is None:
+        # the first window of the normal wave is used as reference
+        reference_wave = first["normal_wave"][:window_size]
+        reference_profile = ReferenceProfile.from_wave(reference_wave[zero_crossing_mask(reference_wave[None, :])[0]])
+
+    evaluate = partial(evaluate_chunk, reference_profile, window_size, step_size)
+    results = [evaluate(first)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results.extend(pool.map(evaluate, chunks))
+    else:
+        results.extend(map(evaluate, chunks))
+
+    kl_divergences = np.concatenate([result[0] for result in results])
+    ground_truth = np.concatenate([result[1] for result in results])
+    return kl_divergences, ground_truth
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calculate a KL divergence threshold for anomaly detection")
+    parser.add_argument("dataset", nargs="?", default="dataset.csv", help="dataset created by gen_dataset.py, .csv, .npy or .parquet")
+    parser.add_argument("--profile", default=None, help="reference profile (.npz), by default the first window of the normal wave is used")
+    parser.add_argument("--window", type=int, default=1000, help="window size in samples, 1000 samples = 1 second")
+    parser.add_argument("--step", type=int, default=1000, help="distance between two windows in samples")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="samples read at a time")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes computing the KL divergences")
+    parser.add_argument("--no-plot", action="store_true", help="do not plot the results")
+    args = parser.parse_args()
+
+    reference_profile = ReferenceProfile.load(args.profile) if args.profile is not None else None
+    kl_divergences, ground_truth_chunks = calibrate(args.dataset, reference_profile, window_size=args.window,
+                                                    step_size=args.step, chunk_size=args.chunk_size, workers=args.workers)
+
+    # Set a threshold for anomaly detection (e.g., mean + 2 standard deviations)
+    kl_threshold = np.mean(kl_divergences) + 0.1 * np.std(kl_divergences)
+    print(f"Anomaly detection threshold (KL Divergence): {kl_threshold}")
+
+    # Detect anomalies based on KL divergence
+    anomaly_predictions = kl_divergences > kl_threshold
+
+    # Calculate accuracy, precision, recall, and F1-score
+    print(f"Accuracy: {accuracy_score(ground_truth_chunks, anomaly_predictions):.4f}")
+    print(f"Precision: {precision_score(ground_truth_chunks, anomaly_predictions, zero_division=0):.4f}")
+    print(f"Recall: {recall_score(ground_truth_chunks, anomaly_predictions, zero_division=0):.4f}")
+    print(f"F1-Score: {f1_score(ground_truth_chunks, anomaly_predictions, zero_division=0):.4f}")
+
+    # Sweep all candidate thresholds, a window is predicted as anomalous if its KL divergence >= threshold
+    precision, recall, thresholds = precision_recall_curve(ground_truth_chunks, kl_divergences)
+    f1_scores = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+    best = np.argmax(f1_scores[:-1])
+    print(f"Best F1-Score {f1_scores[best]:.4f} at threshold {thresholds[best]} "
+          f"(precision {precision[best]:.4f}, recall {recall[best]:.4f})")
+
+    # Display the number of detected anomalies
+    print(f"Detected {np.sum(anomaly_predictions)} anomalies out of {len(kl_divergences)} chunks.")
+
+    if not args.no_plot:
+        import matplotlib.pyplot as plt
+
+        # Plot the KL divergence, the ground truth 'is_anomaly' labels and the precision/recall curve
+        plt.figure(figsize=(12, 9))
+
+        plt.subplot(3, 1, 1)
+        plt.plot(kl_divergences, label='KL Divergence', color='b')
+        plt.axhline(y=kl_threshold, color='r', linestyle='--', label='Threshold')
+        plt.title('KL Divergence Over Chunks')
+        plt.xlabel('Chunk Index')
+        plt.ylabel('KL Divergence')
+        plt.legend()
+
+        plt.subplot(3, 1, 2)
+        plt.plot(ground_truth_chunks, label='True Anomalies', color='g')
+        plt.title('Ground Truth Anomalies (is_anomaly)')
+        plt.xlabel('Chunk Index')
+        plt.ylabel('Anomaly (0 or 1)')
+        plt.legend()
+
+        plt.subplot(3, 1, 3)
+        plt.plot(recall, precision, color='b')
+        plt.title('Precision/Recall Curve')
+        plt.xlabel('Recall')
+        plt.ylabel('Precision')
+
+        plt.tight_layout()
+        plt.show()
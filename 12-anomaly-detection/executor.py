@@ -1,182 +1,176 @@
-from pycolonies import Crypto
-from pycolonies import colonies_client
 import signal
 import os
-import requests
 import numpy as np
-from scipy.stats import entropy
-import pandas as pd
 import string
 import random
+from colonies_executor import Executor, function
+from reference_profile import ReferenceProfile, KL_THRESHOLD
+from sliding_detector import locate_anomalies
+from waveform import generate_single_sample
+import tsdb_client
+
+def stack_waves(waves):
+    # series of different lengths are padded with NaN, which are ignored when computing the histograms
+    max_len = max(len(wave) for wave in waves)
+    stacked = np.full((len(waves), max_len), np.nan)
+    for i, wave in enumerate(waves):
+        stacked[i, :len(wave)] = wave
+    return stacked
+
+class AnomalyDetectorExecutor(Executor):
+    def __init__(self, workers=1, pool="thread", reference_profile_path=None, prefetch=0):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"Invalid pool mode: {pool}, must be 'thread' or 'process'")
+
+        self.reference_profile_path = reference_profile_path
+        if reference_profile_path is not None:
+            self.reference_profile = ReferenceProfile.load(reference_profile_path)
+        else:
+            reference_df = generate_single_sample()
+            self.reference_profile = ReferenceProfile.from_wave(reference_df['normal_wave'].values)
+        print("Using reference profile", self.reference_profile.version)
 
-class AnomalyDetectorExecutor:
-    def __init__(self):
-        colonies, colonyname, colony_prvkey, _, _ = colonies_client()
-        self.colonies = colonies
-        self.colonyname = colonyname
-        self.colony_prvkey = colony_prvkey
-    
         ## generate a 5 long unique id
         id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
 
-        self.executorname = "anomaly-executor-" + id
-        self.executortype = "anomaly-executor"
-
-        reference_df = self.generate_single_sample()
-        self.reference_wave = reference_df['normal_wave'].values
-
-        crypto = Crypto()
-        self.executor_prvkey = crypto.prvkey()
-        self.executorid = crypto.id(self.executor_prvkey)
-
-        self.register()
+        # in process mode, the anomaly detection runs in a pool of worker processes, see self.offload()
+        super().__init__("anomaly-executor", executorname="anomaly-executor-" + id, workers=workers, pool=pool,
+                         prefetch=prefetch)
         
+    # all requests to a database share one keep-alive connection pool, see tsdb_client.py
     def fetch_time_series(self, db, ts_id):
-        url = f"{db}/timeseries/{ts_id}"
-        response = requests.get(url)
-    
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to fetch time series. Status code: {response.status_code}")
+        _, values = tsdb_client.client(db).get_time_series(ts_id)
+        return values
 
     def update_anomaly_status(self, db, ts_id, anomaly_status):
-        url = f"{db}/timeseries/{ts_id}/anomaly"
+        try:
+            tsdb_client.client(db).update_anomaly_status(ts_id, anomaly_status, "5678")
+            print(f"Database updated successfully. Timeseries ID: {ts_id}, Anomaly: {anomaly_status}, Process ID: 5678")
+        except Exception as err:
+            print(err)
 
-        params = {"anomaly": anomaly_status, "process_id": "5678"}
-        response = requests.patch(url, params=params)
+    def fetch_time_series_bulk(self, db, ts_ids):
+        return tsdb_client.client(db).get_time_series_bulk(ts_ids)
 
-        if response.status_code == 200:
-            print(f"Database updated successfully. Timeseries ID: {ts_id}, Anomaly: {anomaly_status}, Process ID: 5678")
-        else:
-            print(f"Failed to update the database. Status code: {response.status_code}")
-            print(f"Response: {response.text}")
-
-    def convert_to_dataframe(self, time_series_data):
-        time_series = time_series_data['data']
-
-        df = pd.DataFrame(time_series)
-
-        return df
-
-    def compute_histogram(self, data, bins=50):
-        hist, bin_edges = np.histogram(data, bins=bins, density=True)
-        hist = hist + 1e-10  # Avoid division by zero
-        return hist, bin_edges
-
-    def compute_kl_divergence(self, p, q):
-        return entropy(p, q)
-
-    def detect_anomaly(self, sample_wave, kl_threshold=0.010199148586751076):
-        sample_hist, _ = self.compute_histogram(sample_wave)
-        reference_hist, _ = self.compute_histogram(self.reference_wave)
-        kl_div = self.compute_kl_divergence(reference_hist, sample_hist)
-        anomaly_detected = kl_div > kl_threshold
-
-        return anomaly_detected, kl_div
-    
-    def generate_single_sample(self, duration=1, sampling_rate=1000, frequency=50, amplitude=230,anomaly_probability=0.0001, 
-                               anomaly_duration=100, anomaly_drop=0.2):
-         time = np.arange(0, duration, 1/sampling_rate)
-   
-         normal_wave = amplitude * np.sqrt(2) * np.sin(2 * np.pi * frequency * time)
-         anomaly_wave = np.copy(normal_wave)
-         labels = np.zeros_like(time, dtype=int)
-   
-         in_anomaly = False
-         for i in range(len(time)):
-             if np.random.rand() < anomaly_probability and not in_anomaly:
-                 end_index = min(i + anomaly_duration, len(time))
-                 anomaly_wave[i:end_index] = anomaly_wave[i:end_index] * anomaly_drop
-                 labels[i:end_index] = 1
-                 in_anomaly = True
-             elif labels[i] == 0:
-                 in_anomaly = False
-   
-         data = {
-             'time': time,
-             'normal_wave': normal_wave,
-             'anomaly_wave': anomaly_wave,
-             'is_anomaly': labels
-         }
-   
-         return pd.DataFrame(data)
-
-    def register(self):
-        executor = {
-            "executorname": self.executorname,
-            "executorid": self.executorid,
-            "colonyname": self.colonyname,
-            "executortype": self.executortype
-        }
-        
+    def update_anomaly_status_bulk(self, db, anomalies, process_id):
         try:
-            executor = self.colonies.add_executor(executor, self.colony_prvkey)
-            self.colonies.approve_executor(self.colonyname, self.executorname, self.colony_prvkey)
-            
-            self.colonies.add_function(self.colonyname, 
-                                       self.executorname, 
-                                       "anomaly",  
-                                       self.executor_prvkey)
+            tsdb_client.client(db).update_anomaly_status_bulk(anomalies, process_id)
+            print(f"Database updated successfully. {len(anomalies)} time series, Process ID: {process_id}")
         except Exception as err:
             print(err)
-            os._exit(0)
-        
-        print("Executor", self.executorname, "registered")
-        
-    def start(self):
-        while (True):
-            try:
-                process = self.colonies.assign(self.colonyname, 10, self.executor_prvkey)
-                print("Process", process.processid, "is assigned to executor")
-                if process.spec.funcname == "anomaly":
-                    ts_ids = process.spec.args
-                    db = process.spec.kwargs["db"]
-                    print("DB:", db)
-                    print("TS IDs:", ts_ids)
-                    
-                    for ts_id in ts_ids:
-                        logMsg = f"Checking anomalies in time series with ID: {ts_ids}"
-                        self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
-                        logMsg = f"Fetching time series data with ID: {ts_id} from database {db}"
-                        self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
-                        time_series_data = self.fetch_time_series(db, ts_id)
-                        
-                        logMsg = f"Converting time series data to dataframe"
-                        self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
-                        df = self.convert_to_dataframe(time_series_data)
-
-                        logMsg = f"Detecting anomalies in time series with ID: {ts_id}"
-                        self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
-                        sample_wave = df['value'].values
-                        anomaly_detected, kl_divergence = self.detect_anomaly(sample_wave)
-    
-                        if anomaly_detected:
-                            logMsg = f"Anomaly detected! KL Divergence: {kl_divergence}, time series ID: {ts_id}"
-                            print(logMsg)
-                            self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
-                            self.update_anomaly_status(db, ts_id, True)
-                        else:
-                            logMsg = f"No anomaly detected. KL Divergence: {kl_divergence}, time series ID: {ts_id}"
-                            print(logMsg)
-                            self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
-                            self.update_anomaly_status(db, ts_id, False)
-                        
-                    self.colonies.close(process.processid, [], self.executor_prvkey)
-    
-            except Exception as err:
-                print(err)
-                pass
-
-    def unregister(self):
-        self.colonies.remove_executor(self.colonyname, self.executorname, self.colony_prvkey)
-        print("Executor", self.executorname, "unregistered")
-        os._exit(0)
-
-def sigint_handler(signum, frame):
-    executor.unregister()
+
+    def detect_anomaly(self, sample_wave, kl_threshold=KL_THRESHOLD):
+        return self.offload(self.reference_profile.detect_anomaly, sample_wave, kl_threshold)
+
+    def detect_anomalies(self, sample_waves, kl_threshold=KL_THRESHOLD):
+        return self.offload(self.reference_profile.detect_anomalies, sample_waves, kl_threshold)
+
+    def set_reference_profile(self, reference_profile):
+        # workers pick up the new profile with the next time series, no restart is needed
+        previous = self.reference_profile
+        self.reference_profile = reference_profile
+        print("Reference profile changed from", previous.version, "to", reference_profile.version)
+
+    def reload_reference_profile(self):
+        if self.reference_profile_path is None:
+            print("No reference profile file configured, set ANOMALY_REFERENCE_PROFILE to reload it")
+            return
+        try:
+            self.set_reference_profile(ReferenceProfile.load(self.reference_profile_path))
+        except Exception as err:
+            print("Failed to reload reference profile:", err)
+
+    @function("anomaly")
+    def anomaly(self, process):
+        ts_ids = process.spec.args
+        db = process.spec.kwargs["db"]
+        print("DB:", db)
+        print("TS IDs:", ts_ids)
+
+        # set the kwarg batch to false to fetch, check and update the time series one by one
+        if process.spec.kwargs.get("batch", "true") == "false":
+            self.check_time_series(process, db, ts_ids)
+        else:
+            self.check_time_series_batch(process, db, ts_ids)
+
+        return []
+
+    def check_time_series(self, process, db, ts_ids):
+        for ts_id in ts_ids:
+            logMsg = f"Checking anomalies in time series with ID: {ts_ids}"
+            self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+            logMsg = f"Fetching time series data with ID: {ts_id} from database {db}"
+            self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+            sample_wave = self.fetch_time_series(db, ts_id)
+
+            logMsg = f"Detecting anomalies in time series with ID: {ts_id}"
+            self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+            anomaly_detected, kl_divergence = self.detect_anomaly(sample_wave)
+            self.count("series")
+
+            if anomaly_detected:
+                logMsg = f"Anomaly detected! KL Divergence: {kl_divergence}, time series ID: {ts_id}"
+                print(logMsg)
+                self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+                self.update_anomaly_status(db, ts_id, True)
+                self.count("anomalies")
+            else:
+                logMsg = f"No anomaly detected. KL Divergence: {kl_divergence}, time series ID: {ts_id}"
+                print(logMsg)
+                self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+                self.update_anomaly_status(db, ts_id, False)
+
+    def check_time_series_batch(self, process, db, ts_ids):
+        # one fetch, one detection over all series and one update, regardless of the number of time series
+        ts_ids = list(dict.fromkeys(ts_ids))
+        if len(ts_ids) == 0:
+            # nothing to check, closed like the one by one path does
+            return
+
+        logMsg = f"Fetching {len(ts_ids)} time series from database {db}"
+        self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+        waves = self.fetch_time_series_bulk(db, ts_ids)
+
+        sample_waves = stack_waves([waves[ts_id] for ts_id in ts_ids])
+        reference_profile = self.reference_profile
+        anomalies_detected, kl_divergences = self.offload(reference_profile.detect_anomalies, sample_waves, KL_THRESHOLD)
+        self.count("series", len(ts_ids))
+        self.count("anomalies", int(np.sum(anomalies_detected)))
+
+        anomalies = {ts_id: bool(anomaly) for ts_id, anomaly in zip(ts_ids, anomalies_detected)}
+        self.update_anomaly_status_bulk(db, anomalies, process.processid)
+
+        anomalous = [f"{ts_id} (KL Divergence: {kl})" for ts_id, kl, anomaly in zip(ts_ids, kl_divergences, anomalies_detected) if anomaly]
+        logMsg = f"Checked {len(ts_ids)} time series using reference profile {reference_profile.version}, {len(anomalous)} anomalies detected: {anomalous}"
+        print(logMsg)
+        self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+
+        # set the kwarg window to also find where the anomalies are, using a sliding window of that many samples
+        window = int(process.spec.kwargs.get("window", "0"))
+        if window > 0:
+            step = int(process.spec.kwargs.get("step", "1"))
+            for ts_id, anomaly in anomalies.items():
+                if anomaly:
+                    events = self.offload(locate_anomalies, reference_profile, waves[ts_id], window, step)
+                    offsets = [f"{'start' if event.anomaly else 'end'} at sample {event.offset}" for event in events]
+                    logMsg = f"Anomalies in time series with ID: {ts_id}: {offsets}"
+                    print(logMsg)
+                    self.colonies.add_log(process.processid, logMsg, self.executor_prvkey)
+
+    def print_stats(self):
+        super().print_stats()
+        for client in tsdb_client.clients.values():
+            client.print_metrics()
+
+def sighup_handler(signum, frame):
+    executor.reload_reference_profile()
 
 if __name__ == '__main__':
-    signal.signal(signal.SIGINT, sigint_handler)
-    executor = AnomalyDetectorExecutor()
+    signal.signal(signal.SIGHUP, sighup_handler)
+    workers = int(os.getenv("ANOMALY_EXECUTOR_WORKERS", "1"))
+    pool = os.getenv("ANOMALY_EXECUTOR_POOL", "thread")
+    reference_profile_path = os.getenv("ANOMALY_REFERENCE_PROFILE")
+    prefetch = int(os.getenv("ANOMALY_EXECUTOR_PREFETCH", "0"))
+    executor = AnomalyDetectorExecutor(workers=workers, pool=pool, reference_profile_path=reference_profile_path, prefetch=prefetch)
+    executor.install_signal_handlers()
     executor.start()
@@ -0,0 +1,84 @@
+import hashlib
+import numpy as np
+
+# calculated by calc_kl_div_threshold.py
+KL_THRESHOLD = 0.010199148586751076
+
+class ReferenceProfile:
+    def __init__(self, bin_edges, hist, version=None):
+        self.bin_edges = np.asarray(bin_edges, dtype=np.float64)
+        self.bins = len(self.bin_edges) - 1
+        self.hist = np.asarray(hist, dtype=np.float64)
+        self.hist = self.hist / np.sum(self.hist)
+        self.log_prob = np.log(self.hist)
+
+        # sum(p * log(p)), the part of the KL divergence that only depends on the reference
+        self.neg_entropy = np.sum(self.hist * self.log_prob)
+
+        if version is None:
+            version = hashlib.sha256(self.bin_edges.tobytes() + self.hist.tobytes()).hexdigest()[:12]
+        self.version = version
+
+    @classmethod
+    def from_wave(cls, reference_wave, bins=50, version=None):
+        hist, bin_edges = np.histogram(reference_wave, bins=bins, density=True)
+        hist = hist + 1e-10  # Avoid division by zero
+        return cls(bin_edges, hist, version=version)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as profile:
+            return cls(profile["bin_edges"], profile["hist"], version=str(profile["version"]))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, bin_edges=self.bin_edges, hist=self.hist, version=self.version)
+
+    def bin_indices(self, data):
+        # samples outside the reference range are counted in the first and last bins
+        indices = np.searchsorted(self.bin_edges, data, side="right") - 1
+        return np.clip(indices, 0, self.bins - 1)
+
+    def histogram(self, sample_wave):
+        counts = np.bincount(self.bin_indices(sample_wave), minlength=self.bins)
+        return self.normalize(counts)
+
+    def histograms(self, sample_waves, valid=None):
+        # one histogram per row, NaN values (padding) and samples where valid is False are ignored
+        if valid is None:
+            valid = ~np.isnan(sample_waves)
+        rows = np.broadcast_to(np.arange(sample_waves.shape[0])[:, None], sample_waves.shape)
+        indices = rows[valid] * self.bins + self.bin_indices(sample_waves[valid])
+        counts = np.bincount(indices, minlength=sample_waves.shape[0] * self.bins)
+        return self.normalize(counts.reshape(sample_waves.shape[0], self.bins))
+
+    def normalize(self, counts):
+        bin_widths = np.diff(self.bin_edges)
+        total = np.sum(counts, axis=-1, keepdims=True)
+        density = counts / (np.maximum(total, 1) * bin_widths)
+        density = density + 1e-10  # Avoid division by zero
+        return density / np.sum(density, axis=-1, keepdims=True)
+
+    def kl_divergence(self, sample_wave):
+        return self.neg_entropy - np.dot(self.hist, np.log(self.histogram(sample_wave)))
+
+    def kl_divergences(self, sample_waves, valid=None):
+        return self.neg_entropy - np.log(self.histograms(sample_waves, valid)) @ self.hist
+
+    def detect_anomaly(self, sample_wave, kl_threshold):
+        kl_div = self.kl_divergence(sample_wave)
+        return kl_div > kl_threshold, kl_div
+
+    def detect_anomalies(self, sample_waves, kl_threshold):
+        kl_divs = self.kl_divergences(sample_waves)
+        return kl_divs > kl_threshold, kl_divs
+
+if __name__ == '__main__':
+    # create a profile from the normal wave in a dataset, e.g. python3 reference_profile.py dataset.csv profile.npz
+    import sys
+    import pandas as pd
+
+    df = pd.read_csv(sys.argv[1])
+    profile = ReferenceProfile.from_wave(df['normal_wave'].values)
+    profile.save(sys.argv[2])
+    print("Reference profile", profile.version, "saved to", sys.argv[2])
@@ -0,0 +1,80 @@
+from collections import namedtuple
+import numpy as np
+from reference_profile import KL_THRESHOLD
+
+# anomaly is True when an anomaly starts at offset, and False when it ends. The offset is the index of
+# the last sample in the window, counted from the first sample pushed to the detector.
+AnomalyEvent = namedtuple("AnomalyEvent", ["offset", "kl_divergence", "anomaly"])
+
+class SlidingWindowKLDetector:
+    # Keeps the histogram of the last window samples, binned using the bin edges of the reference profile.
+    # When a sample enters or leaves the window only one bin changes, so the KL divergence
+    #
+    #   KL = sum(p * log(p)) - sum(p * log(q)),  q = (c / (n * w) + eps) / Z,  Z = sum(c / (n * w) + eps)
+    #
+    # is updated in constant time by keeping sum(p * log(c / (n * w) + eps)) and sum(c / w) up to date.
+    def __init__(self, reference_profile, window=1000, step=1, kl_threshold=KL_THRESHOLD):
+        self.profile = reference_profile
+        self.window = window
+        self.step = step
+        self.kl_threshold = kl_threshold
+
+        self.bin_widths = np.diff(reference_profile.bin_edges)
+        self.ring = np.zeros(window, dtype=np.int64)
+        self.counts = np.zeros(reference_profile.bins, dtype=np.int64)
+        self.offset = 0  # number of samples pushed so far
+        self.in_anomaly = False
+        self.kl_divergence = None
+
+        self.log_sum = 0.0
+        self.weighted_count = 0.0
+
+    def recompute(self):
+        # full O(bins) computation, also used to get rid of rounding errors from the incremental updates
+        density = self.counts / (self.window * self.bin_widths) + 1e-10
+        self.log_sum = np.dot(self.profile.hist, np.log(density))
+        self.weighted_count = np.sum(self.counts / self.bin_widths)
+
+    def current_kl_divergence(self):
+        total = self.weighted_count / self.window + 1e-10 * self.profile.bins
+        return self.profile.neg_entropy - self.log_sum + np.log(total)
+
+    def update(self, b, delta):
+        p = self.profile.hist[b]
+        n_w = self.window * self.bin_widths[b]
+        self.log_sum -= p * np.log(self.counts[b] / n_w + 1e-10)
+        self.counts[b] += delta
+        self.log_sum += p * np.log(self.counts[b] / n_w + 1e-10)
+        self.weighted_count += delta / self.bin_widths[b]
+
+    def push(self, values):
+        events = []
+        for b in self.profile.bin_indices(np.asarray(values, dtype=np.float64)).tolist():
+            pos = self.offset % self.window
+            if self.offset < self.window:
+                self.counts[b] += 1
+            else:
+                old = self.ring[pos]
+                if old != b:
+                    self.update(old, -1)
+                    self.update(b, 1)
+            self.ring[pos] = b
+            self.offset += 1
+
+            if self.offset < self.window or (self.offset - self.window) % self.step != 0:
+                continue
+
+            if pos == self.window - 1:
+                self.recompute()
+
+            self.kl_divergence = self.current_kl_divergence()
+            anomaly = self.kl_divergence > self.kl_threshold
+            if anomaly != self.in_anomaly:
+                self.in_anomaly = anomaly
+                events.append(AnomalyEvent(self.offset - 1, float(self.kl_divergence), bool(anomaly)))
+
+        return events
+
+def locate_anomalies(reference_profile, sample_wave, window, step=1, kl_threshold=KL_THRESHOLD):
+    detector = SlidingWindowKLDetector(reference_profile, window=window, step=step, kl_threshold=kl_threshold)
+    return detector.push(sample_wave)
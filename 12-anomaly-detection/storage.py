@@ -0,0 +1,233 @@
+import json
+import sqlite3
+import threading
+import numpy as np
+
+# Every time series is stored as a list of segments. A segment holds contiguous float64 arrays of
+# timestamps and values, and the offset of its first sample in the time series. Samples are returned in the
+# order they were appended, the timestamps are not sorted. The time strings sent as JSON are kept next to
+# them (labels), so they are returned as they were sent. Segments sent in the binary format have no labels.
+
+def time_labels(segments):
+    # segments are (times, labels) pairs, samples without a label get their timestamp as label
+    labels = []
+    for times, segment_labels in segments:
+        labels.extend(segment_labels if segment_labels is not None else [str(t) for t in times.tolist()])
+    return labels
+
+class MemoryStorage:
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def put(self, ts_id, times, values, anomaly=False, process_id=None, labels=None):
+        with self.lock:
+            self.series[ts_id] = {
+                "segments": [(np.asarray(times, dtype=np.float64), np.asarray(values, dtype=np.float64), labels)],
+                "length": len(values),
+                "anomaly": anomaly,
+                "process_id": process_id
+            }
+
+    def append(self, ts_id, times, values, labels=None):
+        # only the new samples are copied, the segments are concatenated the next time the series is read
+        with self.lock:
+            record = self.series.setdefault(ts_id, {"segments": [], "length": 0, "anomaly": False, "process_id": None})
+            record["segments"].append((np.array(times, dtype=np.float64), np.array(values, dtype=np.float64), labels))
+            record["length"] += len(values)
+            return record["length"]
+
+    def merged(self, record):
+        # called with the lock held, concatenates the segments of a time series into one
+        if len(record["segments"]) > 1:
+            segments = record["segments"]
+            times = np.concatenate([segment[0] for segment in segments])
+            values = np.concatenate([segment[1] for segment in segments])
+            labels = None
+            if any(segment[2] is not None for segment in segments):
+                labels = time_labels((segment[0], segment[2]) for segment in segments)
+            record["segments"] = [(times, values, labels)]
+        return record["segments"][0]
+
+    def get(self, ts_id):
+        with self.lock:
+            record = self.series.get(ts_id)
+            if record is None:
+                return None
+
+            if len(record["segments"]) == 0:
+                return np.empty(0), np.empty(0)
+
+            return self.merged(record)[:2]
+
+    def get_labels(self, ts_id):
+        with self.lock:
+            record = self.series.get(ts_id)
+            if record is None:
+                return None
+
+            if len(record["segments"]) == 0:
+                return []
+
+            times, _, labels = self.merged(record)
+            return time_labels([(times, labels)])
+
+    def get_meta(self, ts_id):
+        with self.lock:
+            record = self.series.get(ts_id)
+            if record is None:
+                return None
+            return {"ts_id": ts_id, "process_id": record["process_id"], "anomaly": record["anomaly"], "length": record["length"]}
+
+    def list(self, anomaly):
+        with self.lock:
+            return [{"ts_id": ts_id, "process_id": record["process_id"], "anomaly": record["anomaly"]}
+                    for ts_id, record in self.series.items() if record["anomaly"] == anomaly]
+
+    def set_anomaly(self, ts_id, anomaly, process_id):
+        return self.set_anomalies({ts_id: anomaly}, process_id)
+
+    def set_anomalies(self, anomalies, process_id):
+        with self.lock:
+            if any(ts_id not in self.series for ts_id in anomalies):
+                return False
+            for ts_id, anomaly in anomalies.items():
+                self.series[ts_id]["anomaly"] = anomaly
+                self.series[ts_id]["process_id"] = process_id
+            return True
+
+    def delete(self, ts_id):
+        with self.lock:
+            return self.series.pop(ts_id, None) is not None
+
+    def __contains__(self, ts_id):
+        return ts_id in self.series
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA cache_size=-65536")  # 64 MB page cache, the rest stays on disk
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS series (
+                                 ts_id TEXT PRIMARY KEY,
+                                 process_id TEXT,
+                                 anomaly INTEGER NOT NULL DEFAULT 0,
+                                 length INTEGER NOT NULL DEFAULT 0,
+                                 segments INTEGER NOT NULL DEFAULT 0)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS segments (
+                                 ts_id TEXT NOT NULL,
+                                 seq INTEGER NOT NULL,
+                                 offset INTEGER NOT NULL,
+                                 times BLOB NOT NULL,
+                                 vals BLOB NOT NULL,
+                                 labels TEXT,
+                                 PRIMARY KEY (ts_id, seq)) WITHOUT ROWID""")
+        # databases created before the time strings were kept have no labels column
+        if "labels" not in [row[1] for row in self.conn.execute("PRAGMA table_info(segments)")]:
+            self.conn.execute("ALTER TABLE segments ADD COLUMN labels TEXT")
+        self.conn.commit()
+
+    def put(self, ts_id, times, values, anomaly=False, process_id=None, labels=None):
+        times = np.ascontiguousarray(times, dtype="<f8")
+        values = np.ascontiguousarray(values, dtype="<f8")
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE ts_id = ?", (ts_id,))
+            self.conn.execute("INSERT OR REPLACE INTO series (ts_id, process_id, anomaly, length, segments) VALUES (?, ?, ?, ?, 1)",
+                              (ts_id, process_id, int(anomaly), len(values)))
+            self.conn.execute("INSERT INTO segments (ts_id, seq, offset, times, vals, labels) VALUES (?, 0, 0, ?, ?, ?)",
+                              (ts_id, times.tobytes(), values.tobytes(), json.dumps(labels) if labels is not None else None))
+
+    def append(self, ts_id, times, values, labels=None):
+        # a new segment is added, so the cost only depends on the number of new samples
+        times = np.ascontiguousarray(times, dtype="<f8")
+        values = np.ascontiguousarray(values, dtype="<f8")
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT length, segments FROM series WHERE ts_id = ?", (ts_id,)).fetchone()
+            if row is None:
+                row = (0, 0)
+                self.conn.execute("INSERT INTO series (ts_id, anomaly, length, segments) VALUES (?, 0, 0, 0)", (ts_id,))
+            length, segments = row
+            self.conn.execute("INSERT INTO segments (ts_id, seq, offset, times, vals, labels) VALUES (?, ?, ?, ?, ?, ?)",
+                              (ts_id, segments, length, times.tobytes(), values.tobytes(),
+                               json.dumps(labels) if labels is not None else None))
+            self.conn.execute("UPDATE series SET length = ?, segments = ? WHERE ts_id = ?",
+                              (length + len(values), segments + 1, ts_id))
+            return length + len(values)
+
+    def get(self, ts_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT offset, times, vals FROM segments WHERE ts_id = ? ORDER BY seq", (ts_id,)).fetchall()
+            if len(rows) == 0 and not self.exists(ts_id):
+                return None
+        return self.concatenate(rows)
+
+    def get_labels(self, ts_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT times, labels FROM segments WHERE ts_id = ? ORDER BY seq", (ts_id,)).fetchall()
+            if len(rows) == 0 and not self.exists(ts_id):
+                return None
+        return time_labels((np.frombuffer(row[0], dtype="<f8"), json.loads(row[1]) if row[1] is not None else None)
+                           for row in rows)
+
+    def concatenate(self, rows):
+        if len(rows) == 0:
+            return np.empty(0), np.empty(0)
+        if len(rows) == 1:
+            return np.frombuffer(rows[0][1], dtype="<f8"), np.frombuffer(rows[0][2], dtype="<f8")
+        times = np.concatenate([np.frombuffer(row[1], dtype="<f8") for row in rows])
+        values = np.concatenate([np.frombuffer(row[2], dtype="<f8") for row in rows])
+        return times, values
+
+    def get_meta(self, ts_id):
+        with self.lock:
+            row = self.conn.execute("SELECT process_id, anomaly, length FROM series WHERE ts_id = ?", (ts_id,)).fetchone()
+        if row is None:
+            return None
+        return {"ts_id": ts_id, "process_id": row[0], "anomaly": bool(row[1]), "length": row[2]}
+
+    def list(self, anomaly):
+        with self.lock:
+            rows = self.conn.execute("SELECT ts_id, process_id, anomaly FROM series WHERE anomaly = ?", (int(anomaly),)).fetchall()
+        return [{"ts_id": row[0], "process_id": row[1], "anomaly": bool(row[2])} for row in rows]
+
+    def set_anomaly(self, ts_id, anomaly, process_id):
+        return self.set_anomalies({ts_id: anomaly}, process_id)
+
+    def set_anomalies(self, anomalies, process_id):
+        with self.lock, self.conn:
+            if not all(self.exists(ts_id) for ts_id in anomalies):
+                return False
+            self.conn.executemany("UPDATE series SET anomaly = ?, process_id = ? WHERE ts_id = ?",
+                                  [(int(anomaly), process_id, ts_id) for ts_id, anomaly in anomalies.items()])
+            return True
+
+    def delete(self, ts_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE ts_id = ?", (ts_id,))
+            return self.conn.execute("DELETE FROM series WHERE ts_id = ?", (ts_id,)).rowcount > 0
+
+    def exists(self, ts_id):
+        return self.conn.execute("SELECT 1 FROM series WHERE ts_id = ?", (ts_id,)).fetchone() is not None
+
+    def __contains__(self, ts_id):
+        with self.lock:
+            return self.exists(ts_id)
+
+    def close(self):
+        self.conn.close()
+
+
+def open_storage(engine="sqlite", path="timeseries.db"):
+    if engine == "sqlite":
+        return SQLiteStorage(path)
+    elif engine == "memory":
+        return MemoryStorage()
+    else:
+        raise ValueError(f"Unknown storage engine: {engine}, must be 'sqlite' or 'memory'")
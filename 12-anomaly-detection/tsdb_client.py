@@ -0,0 +1,144 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import wire
+
+# Client for the time series database in backend.py, the time series are sent and received as
+# NumPy arrays using the binary encoding in wire.py. Connections are kept alive and shared between
+# threads, so that a request does not have to open a new TCP connection.
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+class TimeSeriesDBClient:
+    def __init__(self, db, pool_size=16, retries=3, backoff=0.1, timeout=10):
+        self.db = db
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.metrics_lock = threading.Lock()
+        self.metrics = {}
+
+    def request(self, name, method, path, retry=True, **kwargs):
+        # failed connections and 502/503/504 responses are retried, with exponential backoff and full jitter
+        retries = self.retries if retry else 0
+        started = time.time()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, self.db + path, timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    self.record(name, time.time() - started, attempt, response.status_code >= 400)
+                    return response
+            except requests.exceptions.RequestException:
+                if attempt >= retries:
+                    self.record(name, time.time() - started, attempt, True)
+                    raise
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def record(self, name, elapsed, retries, failed):
+        with self.metrics_lock:
+            metrics = self.metrics.setdefault(name, {"requests": 0, "errors": 0, "retries": 0, "total_time": 0.0, "max_time": 0.0})
+            metrics["requests"] += 1
+            metrics["errors"] += int(failed)
+            metrics["retries"] += retries
+            metrics["total_time"] += elapsed
+            metrics["max_time"] = max(metrics["max_time"], elapsed)
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            return {name: dict(metrics) for name, metrics in self.metrics.items()}
+
+    def print_metrics(self):
+        for name, metrics in sorted(self.get_metrics().items()):
+            mean = metrics["total_time"] / metrics["requests"] * 1000
+            print(f"{self.db} {name}: {metrics['requests']} requests, {metrics['errors']} errors, {metrics['retries']} retries, "
+                  f"mean {mean:.2f}ms, max {metrics['max_time'] * 1000:.2f}ms")
+
+    def put_time_series(self, ts_id, values, times=None, anomaly=False):
+        response = self.request("put", "PUT", f"/timeseries/{ts_id}", data=wire.encode(values, times),
+                                params={"anomaly": anomaly}, headers={"Content-Type": wire.CONTENT_TYPE})
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to store time series. Status code: {response.status_code}, response: {response.text}")
+
+    def get_time_series(self, ts_id):
+        response = self.request("get", "GET", f"/timeseries/{ts_id}", headers={"Accept": wire.CONTENT_TYPE})
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch time series. Status code: {response.status_code}")
+
+        times, values, _ = wire.decode(response.content)
+        return times, values
+
+    def get_time_series_bulk(self, ts_ids):
+        response = self.request("get_bulk", "POST", "/timeseries/bulk", json={"ts_ids": ts_ids},
+                                headers={"Accept": wire.CONTENT_TYPE})
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch time series. Status code: {response.status_code}")
+
+        series = wire.decode_many(response.content)
+        missing = [ts_id for ts_id in ts_ids if ts_id not in series]
+        if len(missing) > 0:
+            raise Exception(f"Failed to fetch time series, time series IDs {missing} not found")
+
+        return {ts_id: values for ts_id, (_, values) in series.items()}
+
+    def append_time_series(self, ts_id, values, times=None, window=0, step=1):
+        # if window is set, the backend checks the new samples for anomalies using a sliding window of that many samples,
+        # appends are not idempotent so they are never retried
+        response = self.request("append", "POST", f"/timeseries/{ts_id}/append", retry=False, data=wire.encode(values, times),
+                                params={"window": window, "step": step}, headers={"Content-Type": wire.CONTENT_TYPE})
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to append to time series. Status code: {response.status_code}, response: {response.text}")
+
+        return response.json()
+
+    def update_anomaly_status(self, ts_id, anomaly, process_id):
+        response = self.request("update_anomaly", "PATCH", f"/timeseries/{ts_id}/anomaly",
+                                params={"anomaly": anomaly, "process_id": process_id})
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to update the database. Status code: {response.status_code}, response: {response.text}")
+
+    def update_anomaly_status_bulk(self, anomalies, process_id):
+        response = self.request("update_anomaly_bulk", "PATCH", "/timeseries/anomaly",
+                                json={"process_id": process_id, "anomalies": anomalies})
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to update the database. Status code: {response.status_code}, response: {response.text}")
+
+    def close(self):
+        self.session.close()
+
+clients = {}
+clients_lock = threading.Lock()
+
+def client(db):
+    # one shared client, and connection pool, per database
+    with clients_lock:
+        if db not in clients:
+            clients[db] = TimeSeriesDBClient(db)
+        return clients[db]
+
+def put_time_series(db, ts_id, values, times=None, anomaly=False):
+    client(db).put_time_series(ts_id, values, times=times, anomaly=anomaly)
+
+def get_time_series(db, ts_id):
+    return client(db).get_time_series(ts_id)
+
+def get_time_series_bulk(db, ts_ids):
+    return client(db).get_time_series_bulk(ts_ids)
+
+def append_time_series(db, ts_id, values, times=None, window=0, step=1):
+    return client(db).append_time_series(ts_id, values, times=times, window=window, step=step)
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Synthetic 50 Hz voltage waveforms with injected voltage drops, see the README for a description of the parameters.
+#
+# At every sample outside an anomaly, an anomaly starts with probability anomaly_probability. Instead of drawing a
+# random number for every sample, the distance to the next anomaly is drawn from a geometric distribution, so the
+# cost depends on the number of anomalies and not on the number of samples.
+
+DTYPE = np.dtype([("time", "<f8"), ("normal_wave", "<f8"), ("anomaly_wave", "<f8"), ("is_anomaly", "<i8")])
+
+def anomaly_starts(num_samples, anomaly_probability, anomaly_duration, rng):
+    if anomaly_probability <= 0 or num_samples == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # the next anomaly can start at the earliest one sample after the previous anomaly has ended
+    starts = [np.array([rng.geometric(anomaly_probability) - 1], dtype=np.int64)]
+    expected = int(num_samples / (anomaly_duration + 1 / anomaly_probability) * 1.1) + 16
+    while starts[-1][-1] < num_samples:
+        gaps = rng.geometric(anomaly_probability, size=expected) + anomaly_duration
+        starts.append(starts[-1][-1] + np.cumsum(gaps))
+    starts = np.concatenate(starts)
+    return starts[starts < num_samples]
+
+def anomaly_labels(starts, first, last, anomaly_duration):
+    # labels of the samples in [first, last), for anomalies starting at starts
+    starts = starts[(starts < last) & (starts + anomaly_duration > first)]
+    marks = np.zeros(last - first + 1, dtype=np.int64)
+    np.add.at(marks, np.maximum(starts - first, 0), 1)
+    np.add.at(marks, np.minimum(starts + anomaly_duration - first, last - first), -1)
+    return (np.cumsum(marks[:-1]) > 0).astype(np.int64)
+
+def generate_chunks(duration=1, sampling_rate=1000, frequency=50, amplitude=230, anomaly_probability=0.0001,
+                    anomaly_duration=100, anomaly_drop=0.2, rng=None, chunk_size=1_000_000):
+    # yields (first sample, structured array with the DTYPE columns) for every chunk of the waveform
+    if rng is None:
+        rng = np.random.default_rng()
+
+    num_samples = int(round(duration * sampling_rate))
+    starts = anomaly_starts(num_samples, anomaly_probability, anomaly_duration, rng)
+
+    for first in range(0, num_samples, chunk_size):
+        last = min(first + chunk_size, num_samples)
+        chunk = np.empty(last - first, dtype=DTYPE)
+        chunk["time"] = np.arange(first, last) / sampling_rate
+        chunk["normal_wave"] = amplitude * np.sqrt(2) * np.sin(2 * np.pi * frequency * chunk["time"])
+        chunk["is_anomaly"] = anomaly_labels(starts, first, last, anomaly_duration)
+        chunk["anomaly_wave"] = np.where(chunk["is_anomaly"] == 1, chunk["normal_wave"] * anomaly_drop, chunk["normal_wave"])
+        yield first, chunk
+
+def generate_single_sample(duration=1, sampling_rate=1000, frequency=50, amplitude=230, anomaly_probability=0.0001,
+                           anomaly_duration=100, anomaly_drop=0.2, rng=None, verbose=False):
+    num_samples = int(round(duration * sampling_rate))
+    _, chunk = next(generate_chunks(duration, sampling_rate, frequency, amplitude, anomaly_probability,
+                                    anomaly_duration, anomaly_drop, rng=rng, chunk_size=max(num_samples, 1)),
+                    (0, np.empty(0, dtype=DTYPE)))
+
+    if verbose:
+        for i in np.flatnonzero(np.diff(chunk["is_anomaly"], prepend=0) == 1):
+            print("Anomaly detected at index:", i)
+
+    return pd.DataFrame({name: chunk[name] for name in DTYPE.names})
+
+def write_dataset(path, duration=100, sampling_rate=1000, frequency=50, amplitude=230, anomaly_probability=0.00009,
+                  anomaly_duration=100, anomaly_drop=0.2, rng=None, chunk_size=1_000_000):
+    # the format is given by the file extension: .csv, .npy (structured array) or .parquet (requires pyarrow)
+    num_samples = int(round(duration * sampling_rate))
+    chunks = generate_chunks(duration, sampling_rate, frequency, amplitude, anomaly_probability,
+                             anomaly_duration, anomaly_drop, rng=rng, chunk_size=chunk_size)
+    extension = os.path.splitext(path)[1]
+
+    if extension == ".npy":
+        dataset = np.lib.format.open_memmap(path, mode="w+", dtype=DTYPE, shape=(num_samples,))
+        for first, chunk in chunks:
+            dataset[first:first + len(chunk)] = chunk
+        dataset.flush()
+    elif extension == ".parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Writing .parquet files requires pyarrow, install it with: pip3 install pyarrow")
+
+        schema = pa.schema([(name, pa.from_numpy_dtype(DTYPE[name])) for name in DTYPE.names])
+        with pq.ParquetWriter(path, schema) as writer:
+            for _, chunk in chunks:
+                writer.write_table(pa.table({name: chunk[name] for name in DTYPE.names}, schema=schema))
+    elif extension == ".csv":
+        with open(path, "w") as f:
+            for first, chunk in chunks:
+                pd.DataFrame({name: chunk[name] for name in DTYPE.names}).to_csv(f, index=False, header=first == 0)
+    else:
+        raise ValueError(f"Unsupported dataset format: {extension}, must be .csv, .npy or .parquet")
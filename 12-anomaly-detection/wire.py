@@ -0,0 +1,71 @@
+import struct
+import numpy as np
+
+# Binary encoding of a time series, used when the Content-Type (or Accept) header is set to CONTENT_TYPE.
+#
+#   magic "CTS1" | flags uint8 | 3 bytes padding | count uint64 | values float64[count] | times float64[count]
+#
+# All numbers are little-endian, the times are only included if FLAG_TIMES is set. Several time series
+# (used by the bulk endpoint) are encoded as a sequence of records:
+#
+#   id length uint16 | id utf-8, padded to a multiple of 8 bytes | frame
+
+CONTENT_TYPE = "application/x-timeseries"
+MAGIC = b"CTS1"
+FLAG_TIMES = 1
+HEADER = struct.Struct("<4sB3xQ")
+ID_LENGTH = struct.Struct("<H")
+
+def encode(values, times=None):
+    values = np.ascontiguousarray(values, dtype="<f8")
+    flags = 0
+    parts = [None, values.tobytes()]
+    if times is not None:
+        times = np.ascontiguousarray(times, dtype="<f8")
+        if len(times) != len(values):
+            raise ValueError(f"Length of times ({len(times)}) and values ({len(values)}) differ")
+        flags |= FLAG_TIMES
+        parts.append(times.tobytes())
+    parts[0] = HEADER.pack(MAGIC, flags, len(values))
+    return b"".join(parts)
+
+def decode(data, offset=0):
+    # returns (times, values, end offset), the arrays are read-only views into data
+    if len(data) - offset < HEADER.size:
+        raise ValueError("Truncated time series header")
+    magic, flags, count = HEADER.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise ValueError("Invalid time series encoding, bad magic")
+
+    offset += HEADER.size
+    end = offset + count * 8 * (2 if flags & FLAG_TIMES else 1)
+    if len(data) < end:
+        raise ValueError("Truncated time series data")
+
+    values = np.frombuffer(data, dtype="<f8", count=count, offset=offset)
+    times = None
+    if flags & FLAG_TIMES:
+        times = np.frombuffer(data, dtype="<f8", count=count, offset=offset + count * 8)
+    return times, values, end
+
+def encode_many(series):
+    # series is an iterable of (ts_id, times, values)
+    parts = []
+    for ts_id, times, values in series:
+        ts_id_bytes = ts_id.encode("utf-8")
+        padding = -(ID_LENGTH.size + len(ts_id_bytes)) % 8
+        parts.append(ID_LENGTH.pack(len(ts_id_bytes)) + ts_id_bytes + b"\0" * padding)
+        parts.append(encode(values, times))
+    return b"".join(parts)
+
+def decode_many(data):
+    series = {}
+    offset = 0
+    while offset < len(data):
+        (length,) = ID_LENGTH.unpack_from(data, offset)
+        ts_id = bytes(data[offset + ID_LENGTH.size:offset + ID_LENGTH.size + length]).decode("utf-8")
+        offset += ID_LENGTH.size + length
+        offset += -offset % 8
+        times, values, offset = decode(data, offset)
+        series[ts_id] = (times, values)
+    return series